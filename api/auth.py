@@ -1,14 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from models import UserCreate, UserLogin, UserInDB
 import database
-from utils import get_password_hash, verify_password, create_access_token
+from utils import (
+    create_access_token,
+    get_password_hash_async,
+    password_needs_rehash,
+    verify_password_async,
+)
 from datetime import timedelta
+from typing import Optional
 from jose import JWTError, jwt
 from utils import SECRET_KEY, ALGORITHM
+from services import rollup_service
+from services.user_cache import user_cache
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="api/auth/login", auto_error=False
+)
 
 
 @router.post("/register", response_model=UserInDB)
@@ -17,24 +28,34 @@ async def register(user: UserCreate):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_in_db = UserInDB(**user.dict(), password_hash=hashed_password)
-    new_user = await database.db.users.insert_one(
-        user_in_db.dict(by_alias=True, exclude={"id"})
-    )
-    created_user = await database.db.users.find_one({"_id": new_user.inserted_id})
-    return UserInDB(**created_user)
+    user_doc = user_in_db.dict(by_alias=True, exclude={"id"})
+    # insert_one sets _id on the local document, so there is no re-read
+    await database.db.users.insert_one(user_doc)
+    await rollup_service.mark_new_user(str(user_doc["_id"]))
+    return UserInDB(**user_doc)
 
 
 @router.post("/login")
 async def login(user: UserLogin):  # Simplified for this demo
     db_user = await database.db.users.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password_hash"]):
+    if not db_user or not await verify_password_async(
+        user.password, db_user["password_hash"]
+    ):
         raise HTTPException(status_code=400, detail="Incorrect email or password")
 
+    # Transparently move stored hashes to the configured cost factor
+    if password_needs_rehash(db_user["password_hash"]):
+        await database.db.users.update_one(
+            {"_id": db_user["_id"]},
+            {"$set": {"password_hash": await get_password_hash_async(user.password)}},
+        )
+
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": db_user["email"]}, expires_delta=access_token_expires
+        data={"sub": db_user["email"], "uid": str(db_user["_id"])},
+        expires_delta=access_token_expires,
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -52,7 +73,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+
+    # Tokens issued before the uid claim existed always fall through to Mongo
+    user_id = payload.get("uid")
+    cached = user_cache.get(user_id) if user_id else None
+    if cached is not None and cached.email == email:
+        return cached
+
     user = await database.db.users.find_one({"email": email})
-    if user is None:
+    if user is None or not user.get("is_active", True):
         raise credentials_exception
-    return UserInDB(**user)
+    current_user = UserInDB(**user)
+    user_cache.set(current_user)
+    return current_user
+
+
+async def get_stream_user(
+    access_token: Optional[str] = Query(None),
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+):
+    # EventSource can't set headers, so streams also accept ?access_token=
+    return await get_current_user(header_token or access_token or "")
@@ -0,0 +1,117 @@
+"""Latency of group analytics over a large, multi-year expense history.
+
+Seeds a scratch database with one group, then times the analytics aggregation
+uncached (a new group version each run) and cached.
+
+Usage:
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/analytics.py \
+        [--members 20] [--expenses 50000] [--years 3] [--runs 10]
+"""
+
+from pathlib import Path
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import os
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import index  # noqa: E402,F401  (loads .env before database reads it)
+import database  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from services import analytics_service  # noqa: E402
+
+CATEGORIES = ["General", "Food", "Travel", "Rent", "Utilities", "Shopping"]
+TAGS = ["trip", "weekly", "office", "party", "gift"]
+
+
+async def seed(members: int, expenses: int, years: int) -> str:
+    member_ids = [f"user{i}" for i in range(members)]
+    group = await database.db.groups.insert_one(
+        {"name": "Bench", "members": member_ids, "invite_code": "bench000"}
+    )
+    group_id = str(group.inserted_id)
+
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=365 * years)
+    span = 365 * years * 86400
+    batch = []
+    for i in range(expenses):
+        share = rng.randint(100, 10000)
+        split = {m: share for m in rng.sample(member_ids, rng.randint(2, members))}
+        batch.append(
+            {
+                "description": f"Expense {i}",
+                "amount_minor": share * len(split),
+                "category": rng.choice(CATEGORIES),
+                "tags": rng.sample(TAGS, rng.randint(0, 2)),
+                "date": start + timedelta(seconds=rng.randrange(span)),
+                "payer_id": rng.choice(list(split)),
+                "group_id": group_id,
+                "split_minor": split,
+            }
+        )
+        if len(batch) == 5000:
+            await database.db.expenses.insert_many(batch)
+            batch = []
+    if batch:
+        await database.db.expenses.insert_many(batch)
+    return group_id
+
+
+def report(label: str, timings: list):
+    print(
+        f"{label}: median {statistics.median(timings):.1f} ms, "
+        f"max {max(timings):.1f} ms over {len(timings)} runs"
+    )
+
+
+async def main(args):
+    await database.connect_to_mongo()
+    if database.db is None:
+        sys.exit("MONGODB_URL is required")
+    await database.client.drop_database(args.db)
+    database.db = database.client.get_database(args.db)
+
+    try:
+        await ensure_indexes(database.db)
+        group_id = await seed(args.members, args.expenses, args.years)
+        last_year = datetime.utcnow() - timedelta(days=365)
+
+        for label, start, interval in (
+            ("all history by month", None, "month"),
+            ("last year by week", last_year, "week"),
+            ("last year by day", last_year, "day"),
+        ):
+            cold, warm = [], []
+            for run in range(args.runs):
+                began = time.perf_counter()
+                await analytics_service.group_analytics(
+                    group_id, run, start=start, interval=interval
+                )
+                cold.append(1000 * (time.perf_counter() - began))
+
+                began = time.perf_counter()
+                await analytics_service.group_analytics(
+                    group_id, run, start=start, interval=interval
+                )
+                warm.append(1000 * (time.perf_counter() - began))
+            report(f"{label} (uncached)", cold)
+            report(f"{label} (cached)", warm)
+    finally:
+        await database.client.drop_database(args.db)
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Group analytics latency")
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--expenses", type=int, default=50000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--db", default=os.getenv("BENCH_DB", "splitwise_bench"))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Cold-start import budget for the serverless entry point.
+
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 900]
+
+Imports ``index`` in fresh interpreters under ``-X importtime`` and reports the
+median total, the heaviest modules it pulls in, and what each lazily loaded
+router adds on its first request. Exits with status 1 when the median cold
+import exceeds the budget, so CI can run it as a regression check. The budget
+can also come from IMPORT_BUDGET_MS.
+"""
+
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.append(str(API_DIR))
+
+from index import ROUTERS  # noqa: E402
+
+DEFAULT_BUDGET_MS = 900
+
+
+def import_times(code: str) -> Dict[str, tuple]:
+    """Run ``code`` in a fresh interpreter: module -> (self us, cumulative us, depth)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=API_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times[name.strip()] = (int(own), int(cumulative), depth)
+    return times
+
+
+def median_ms(samples: List[int]) -> float:
+    return statistics.median(samples) / 1000
+
+
+def main(args) -> int:
+    # Prime the bytecode cache so every measured run sees the same state
+    import_times("import index")
+
+    runs = [import_times("import index") for _ in range(args.runs)]
+    total = median_ms([run["index"][1] for run in runs])
+
+    print(f"Cold import of index: {total:.1f} ms median of {args.runs} runs")
+    print(f"\n{'module':<32} {'cumulative ms':>14}")
+    top_level = [name for name, (_, _, depth) in runs[0].items() if depth == 1]
+    heaviest = sorted(
+        top_level,
+        key=lambda name: -median_ms([run[name][1] for run in runs if name in run]),
+    )
+    for name in heaviest[: args.top]:
+        ms = median_ms([run[name][1] for run in runs if name in run])
+        print(f"{name:<32} {ms:>14.1f}")
+
+    print(f"\n{'first request to':<32} {'adds ms':>14}")
+    for prefix, (module, _) in ROUTERS.items():
+        samples = [
+            import_times(f"import index; import {module}")[module][1]
+            for _ in range(args.runs)
+        ]
+        print(f"{prefix:<32} {median_ms(samples):>14.1f}")
+
+    if total > args.budget_ms:
+        print(f"\nFAIL: {total:.1f} ms exceeds the {args.budget_ms} ms budget")
+        return 1
+    print(f"\nOK: within the {args.budget_ms} ms budget")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.getenv("IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)),
+    )
+    sys.exit(main(parser.parse_args()))
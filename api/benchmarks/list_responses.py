@@ -0,0 +1,126 @@
+"""Time a 1k-expense list response through the model path and the fast path.
+
+    python benchmarks/list_responses.py [--items 1000] [--runs 50]
+
+Both routes are real FastAPI routes with ``response_model=List[ExpenseInDB]``,
+called in-process over ASGI so routing, validation and encoding are all
+counted. The two response bodies are checked to decode to the same JSON.
+"""
+
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import List
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bson import ObjectId  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from models import ExpenseInDB  # noqa: E402
+from money import expense_to_api  # noqa: E402
+from serialization import RowShaper, fast_response  # noqa: E402
+
+EXPENSE_ROWS = RowShaper(ExpenseInDB)
+
+
+def stored_expenses(count: int) -> List[dict]:
+    """Documents as the expenses collection holds them."""
+    members = [str(ObjectId()) for _ in range(4)]
+    start = datetime(2024, 1, 1, 12, 30, 15, 250000)
+    docs = []
+    for i in range(count):
+        share = 1000 + i
+        docs.append(
+            {
+                "_id": ObjectId(),
+                "description": f"Expense {i}",
+                "amount_minor": share * len(members),
+                "category": "Food",
+                "tags": ["trip"],
+                "date": start + timedelta(hours=i),
+                "created_at": start,
+                "updated_at": start,
+                "payer_id": members[i % len(members)],
+                "group_id": "65f000000000000000000000",
+                "split_minor": {uid: share for uid in members},
+                "participants": members,
+            }
+        )
+    return docs
+
+
+def build_app(docs: List[dict]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/models", response_model=List[ExpenseInDB])
+    async def models_path():
+        return [ExpenseInDB(**expense_to_api(dict(d))) for d in docs]
+
+    @app.get("/fast", response_model=List[ExpenseInDB])
+    async def fast_path():
+        return fast_response(EXPENSE_ROWS.rows(expense_to_api(dict(d)) for d in docs))
+
+    return app
+
+
+async def call(app: FastAPI, path: str) -> bytes:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("bench", 1),
+        "server": ("bench", 80),
+    }
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def main(args):
+    app = build_app(stored_expenses(args.items))
+
+    slow_body = await call(app, "/models")
+    fast_body = await call(app, "/fast")
+    assert json.loads(slow_body) == json.loads(fast_body), "responses differ"
+
+    print(f"{args.items} expenses, {args.runs} runs")
+    print(f"{'path':>8} {'median ms':>10} {'p95 ms':>8} {'bytes':>8}")
+    for path in ("/models", "/fast"):
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            body = await call(app, path)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(
+            f"{path:>8} {statistics.median(timings):>10.2f} {p95:>8.2f}"
+            f" {len(body):>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
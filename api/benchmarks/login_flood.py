@@ -0,0 +1,86 @@
+"""Latency of a cheap endpoint while logins flood the server.
+
+Run the API first (e.g. ``uvicorn index:app``), then:
+
+    python benchmarks/login_flood.py --url http://localhost:8000 \
+        [--logins 50] [--concurrency 32] [--probes 50]
+
+Registers a throwaway user, fires ``--logins`` concurrent logins and, at the
+same time, measures ``/api/health`` latency. Before password hashing moved to
+a worker pool every login stalled the event loop for the full bcrypt cost.
+Defaults stay under the 60/minute per-IP login budget; for bigger floods raise
+RATE_LIMIT_AUTH on the server under test, or 429s will skip the hashing.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def flood_logins(http, credentials, total, concurrency, statuses):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await http.post("/api/auth/login", json=credentials)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(total)))
+
+
+async def probe(http, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await http.get("/api/health")
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.005)
+    return samples
+
+
+async def main(args):
+    credentials = {
+        "email": f"flood-{uuid.uuid4().hex[:8]}@example.com",
+        "password": "flood-password",
+    }
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as http:
+        response = await http.post(
+            "/api/auth/register", json={"name": "Flood", **credentials}
+        )
+        response.raise_for_status()
+
+        baseline = await probe(http, args.probes // 5)
+
+        statuses = {}
+        flood = asyncio.create_task(
+            flood_logins(http, credentials, args.logins, args.concurrency, statuses)
+        )
+        under_load = await probe(http, args.probes)
+        await flood
+
+    for label, samples in (("idle", baseline), ("during login flood", under_load)):
+        print(
+            f"/api/health {label}: p50={statistics.median(samples):.1f}ms "
+            f"p99={percentile(samples, 99):.1f}ms max={max(samples):.1f}ms"
+        )
+    print(f"login responses: {dict(sorted(statuses.items()))}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--probes", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,120 @@
+"""Count MongoDB round trips per request for the member-resolving endpoints.
+
+Seeds a scratch database with one group, then calls the endpoints in-process
+and reports how many commands each request sent to Mongo.
+
+Usage:
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/round_trips.py \
+        [--members 50] [--expenses 1000] [--db splitwise_bench]
+"""
+
+from pathlib import Path
+from collections import Counter
+import argparse
+import asyncio
+import sys
+import os
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from pymongo import monitoring  # noqa: E402
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = Counter()
+
+    def reset(self):
+        self.commands.clear()
+
+    @property
+    def total(self) -> int:
+        return sum(self.commands.values())
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Must be registered before the Motor client is created
+counter = CommandCounter()
+monitoring.register(counter)
+
+import httpx  # noqa: E402
+from index import app  # noqa: E402  (loads .env before database reads it)
+import database  # noqa: E402
+from utils import create_access_token  # noqa: E402
+
+
+async def seed(members: int, expenses: int) -> str:
+    users = [
+        {
+            "name": f"Bench User {i}",
+            "email": f"bench{i}@example.com",
+            "password_hash": "x",
+        }
+        for i in range(members)
+    ]
+    result = await database.db.users.insert_many(users)
+    member_ids = [str(uid) for uid in result.inserted_ids]
+
+    group = await database.db.groups.insert_one(
+        {"name": "Bench", "members": member_ids, "invite_code": "bench000"}
+    )
+    group_id = str(group.inserted_id)
+
+    share = 1000 // members
+    await database.db.expenses.insert_many(
+        [
+            {
+                "description": f"Expense {i}",
+                "amount_minor": share * members,
+                "category": "General",
+                "payer_id": member_ids[i % members],
+                "group_id": group_id,
+                "split_minor": {m: share for m in member_ids},
+            }
+            for i in range(expenses)
+        ]
+    )
+    return group_id
+
+
+async def main(args):
+    await database.connect_to_mongo()
+    if database.db is None:
+        sys.exit("MONGODB_URL is required")
+    await database.client.drop_database(args.db)
+    database.db = database.client.get_database(args.db)
+
+    try:
+        group_id = await seed(args.members, args.expenses)
+        token = create_access_token({"sub": "bench0@example.com"})
+        headers = {"Authorization": f"Bearer {token}"}
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as http:
+            for path in (f"/api/groups/{group_id}", f"/api/groups/{group_id}/export"):
+                counter.reset()
+                response = await http.get(path, headers=headers)
+                response.raise_for_status()
+                breakdown = ", ".join(f"{k}={v}" for k, v in counter.commands.items())
+                print(f"GET {path}: {counter.total} round trips ({breakdown})")
+    finally:
+        await database.client.drop_database(args.db)
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mongo round trips per request")
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--expenses", type=int, default=1000)
+    parser.add_argument("--db", default=os.getenv("BENCH_DB", "splitwise_bench"))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""Compare settlement modes on random groups: transfer counts and run time.
+
+    python benchmarks/settlements.py [--trials 50] [--seed 1]
+
+Every result is checked for conservation: applying the transfers must bring
+every member's balance to exactly zero (in minor units), and the optimal
+mode must never use more transfers than greedy or heap.
+"""
+
+from pathlib import Path
+import argparse
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from services.balance_service import (  # noqa: E402
+    OPTIMAL_MAX_MEMBERS,
+    settle_greedy,
+    settle_heap,
+    settle_optimal,
+)
+
+MODES = {"greedy": settle_greedy, "heap": settle_heap, "optimal": settle_optimal}
+SIZES = [4, 8, OPTIMAL_MAX_MEMBERS, 50, 200, 1000]
+
+
+def random_balances(rng: random.Random, members: int) -> dict:
+    """Zero-sum balances in minor units, with some exactly offsetting pairs so
+    that multi-cluster solutions exist."""
+    values = []
+    while len(values) < members - 1:
+        amount = rng.randint(1, 500_000)
+        if rng.random() < 0.3 and len(values) < members - 2:
+            values.extend([amount, -amount])
+        else:
+            values.append(rng.choice([amount, -amount]))
+    values.append(-sum(values))
+    return {f"u{i}": v for i, v in enumerate(values) if v != 0}
+
+
+def check_conserved(balances: dict, transfers: list, mode: str):
+    remaining = dict(balances)
+    for debtor, creditor, amount in transfers:
+        assert amount > 0, f"{mode}: non-positive transfer {amount}"
+        remaining[debtor] += amount
+        remaining[creditor] -= amount
+    leftover = {uid: bal for uid, bal in remaining.items() if bal != 0}
+    assert not leftover, f"{mode}: balances not settled {leftover}"
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    print(f"{'members':>8} {'mode':>8} {'transfers':>10} {'ms':>10}")
+    for size in SIZES:
+        results = {mode: ([], []) for mode in MODES}
+        for _ in range(args.trials):
+            balances = random_balances(rng, size)
+            counts = {}
+            for mode, settle in MODES.items():
+                if mode == "optimal" and len(balances) > OPTIMAL_MAX_MEMBERS:
+                    continue
+                start = time.perf_counter()
+                transfers = settle(balances)
+                elapsed = (time.perf_counter() - start) * 1000
+                check_conserved(balances, transfers, mode)
+                counts[mode] = len(transfers)
+                results[mode][0].append(len(transfers))
+                results[mode][1].append(elapsed)
+            if "optimal" in counts:
+                assert counts["optimal"] <= min(counts["greedy"], counts["heap"])
+
+        for mode, (counts, times) in results.items():
+            if counts:
+                print(
+                    f"{size:>8} {mode:>8} {statistics.mean(counts):>10.2f} "
+                    f"{statistics.mean(times):>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
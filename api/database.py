@@ -1,24 +1,169 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+import asyncio
 import os
+import threading
+import time
 
 MONGODB_URL = os.getenv("MONGODB_URL")
+DATABASE_NAME = "splitwise_clone"
+
+# Serverless instances each hold their own pool, so keep pools small and let
+# idle connections go before the platform freezes the instance.
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "10"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+# How long a request may wait for a free pooled connection (0 = forever)
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# Comma-separated wire compressors, e.g. "zstd,zlib"; empty disables them
+COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters for /api/metrics.
+
+    Listeners are called from pymongo's threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_ms_avg": round(
+                    1000 * self.wait_total / self.checkouts if self.checkouts else 0, 3
+                ),
+                "wait_ms_max": round(1000 * self.wait_max, 3),
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        # duration covers the whole checkout, including any wait for a free slot
+        wait = event.duration or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+pool_stats = PoolStats()
 
 client = None
 db = None
+# Motor binds a client to the event loop it first runs on
+_client_loop = None
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "maxIdleTimeMS": MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": READ_PREFERENCE,
+        "event_listeners": [pool_stats],
+    }
+    if WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = WAIT_QUEUE_TIMEOUT_MS
+    if COMPRESSORS:
+        options["compressors"] = COMPRESSORS
+    return options
 
 
 async def connect_to_mongo():
-    global client, db
-    if MONGODB_URL:
-        client = AsyncIOMotorClient(MONGODB_URL)
-        db = client.get_database("splitwise_clone")
-        print("Connected to MongoDB")
-    else:
+    """Create the client, or keep the one from a previous warm invocation.
+
+    Serverless platforms re-run startup in an instance that still has this
+    module loaded; the existing pool is reused unless it belongs to a
+    different event loop, which Motor can't share.
+    """
+    global client, db, _client_loop
+    if not MONGODB_URL:
         print("MONGODB_URL not found")
+        return
+
+    loop = asyncio.get_running_loop()
+    if client is not None:
+        if _client_loop is loop:
+            return
+        client.close()
+        pool_stats.reset()
+
+    client = AsyncIOMotorClient(MONGODB_URL, **client_options())
+    db = client.get_database(DATABASE_NAME)
+    _client_loop = loop
+    print("Connected to MongoDB")
 
 
 async def close_mongo_connection():
-    global client
+    global client, db, _client_loop
     if client:
         client.close()
+        client = db = _client_loop = None
+        pool_stats.reset()
         print("Closed MongoDB connection")
+
+
+async def ping() -> dict:
+    """Round trip to the server, for health checks."""
+    if db is None:
+        return {"ok": False, "error": "not connected"}
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+    except PyMongoError as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "latency_ms": round(1000 * (time.perf_counter() - started), 2)}
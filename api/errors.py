@@ -0,0 +1,9 @@
+"""Exceptions the app maps to responses in ``index``.
+
+Kept free of heavy imports so registering their handlers doesn't pull bcrypt
+or jose into the cold start; the modules that raise them load on first use.
+"""
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are both full."""
@@ -0,0 +1,46 @@
+"""Weak ETags derived from version counters, for conditional GETs.
+
+Groups carry a ``version`` that every group/expense mutation bumps; users have
+a stats version in the ``user_versions`` collection. A matching
+``If-None-Match`` lets a read endpoint answer 304 before loading any data.
+"""
+
+from typing import Optional
+from fastapi import Request, Response
+
+# Browsers store the response but revalidate it on every use
+CACHE_CONTROL = "private, no-cache"
+
+USER_VERSIONS_COLLECTION = "user_versions"
+
+
+def weak_etag(*parts) -> str:
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: the W/ prefix is ignored on both sides
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+def not_modified(
+    request: Request, etag: str, cache_control: str = CACHE_CONTROL
+) -> Optional[Response]:
+    """A 304 response if the client already has ``etag``, otherwise None."""
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(
+            status_code=304, headers={"ETag": etag, "Cache-Control": cache_control}
+        )
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -1,44 +1,195 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models import ExpenseCreate, ExpenseInDB, UserInDB, ExpenseUpdate
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from models import (
+    ExpenseCreate,
+    ExpenseInDB,
+    ExpenseSearchResults,
+    UserInDB,
+    ExpenseUpdate,
+)
 import database
 from auth import get_current_user
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from services import (
+    events_service,
+    import_service,
+    ledger_service,
+    rollup_service,
+    search_service,
+)
+from services.import_service import MAX_IMPORT_ROWS
+from money import (
+    STORED_FIELDS,
+    SplitMismatch,
+    expense_minor,
+    expense_to_api,
+    expense_to_db,
+)
+from services.balance_service import SETTLEMENT_MODES, settle_balances
+from services.expense_service import (
+    NEWEST_FIRST,
+    expense_participants,
+    group_query,
+    with_participants,
+)
+from serialization import FAST_SERIALIZATION, RowShaper, fast_response, partial_rows
+from etag import CACHE_CONTROL, not_modified, set_etag, weak_etag
+from pagination import (
+    NEXT_CURSOR_HEADER,
+    decode_cursor,
+    encode_cursor,
+    keyset_after,
+    parse_fields,
+)
 
 router = APIRouter()
 
+EXPENSE_ROWS = RowShaper(ExpenseInDB)
 
-@router.post("/add", response_model=ExpenseInDB)
-async def add_expense(
-    expense: ExpenseCreate, current_user: UserInDB = Depends(get_current_user)
-):
-    # Validate split sum
-    total_split = sum(expense.split_details.values())
-    if abs(total_split - expense.amount) > 0.01:
-        raise HTTPException(
-            status_code=400, detail="Split amounts do not match total amount"
-        )
 
-    # Check if user is in group
-    group = await database.db.groups.find_one({"_id": ObjectId(expense.group_id)})
+async def _member_group(group_id: str, current_user: UserInDB) -> dict:
+    """Membership and version of a group the current user must belong to."""
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, {"members": 1, "version": 1}
+    )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
     if current_user.id not in group["members"]:
         raise HTTPException(status_code=403, detail="User not in group")
+    return group
 
-    new_expense = await database.db.expenses.insert_one(expense.dict())
-    created_expense = await database.db.expenses.find_one(
-        {"_id": new_expense.inserted_id}
-    )
 
-    # Update group with expense reference
+async def _bump_group_version(group_id: str):
+    """Expire the group's ETags. Called once the expense, ledger and rollup
+    writes are done, so a read in between can't cache old data under the new
+    version."""
     await database.db.groups.update_one(
-        {"_id": ObjectId(expense.group_id)},
-        {"$push": {"expenses": str(created_expense["_id"])}},
+        {"_id": ObjectId(group_id)}, {"$inc": {"version": 1}}
+    )
+
+
+async def _adjust_expense_count(
+    group_id: str, current_user: UserInDB, delta: int, forbidden: str
+):
+    """Move the group's expense counter; the members filter doubles as the
+    permission check, so the happy path needs no separate group read."""
+    result = await database.db.groups.update_one(
+        {"_id": ObjectId(group_id), "members": current_user.id},
+        {"$inc": {"expense_count": delta}},
+    )
+    if result.matched_count:
+        return
+
+    if not await database.db.groups.count_documents(
+        {"_id": ObjectId(group_id)}, limit=1
+    ):
+        raise HTTPException(status_code=404, detail="Group not found")
+    raise HTTPException(status_code=403, detail=forbidden)
+
+
+@router.post("/add", response_model=ExpenseInDB)
+async def add_expense(
+    expense: ExpenseCreate, current_user: UserInDB = Depends(get_current_user)
+):
+    # Validate split sum while converting to integer minor units
+    try:
+        expense_doc = expense_to_db(expense.dict())
+    except SplitMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Check if user is in group while counting the new expense
+    await _adjust_expense_count(expense.group_id, current_user, 1, "User not in group")
+
+    try:
+        # insert_one sets _id on the local document, so there is no re-read
+        created_expense = with_participants(expense_doc)
+        await database.db.expenses.insert_one(created_expense)
+    except Exception:
+        await _adjust_expense_count(expense.group_id, current_user, -1, "")
+        raise
+
+    await ledger_service.record_expense(created_expense)
+    await rollup_service.record_expense(created_expense)
+    await _bump_group_version(expense.group_id)
+    await events_service.expense_changed("expense_created", created_expense)
+
+    return ExpenseInDB(**expense_to_api(created_expense))
+
+
+# Declared before /{expense_id}, which would otherwise capture "search"
+@router.get("/search", response_model=ExpenseSearchResults)
+async def search_expenses(
+    response: Response,
+    q: Optional[str] = Query(None, max_length=200),
+    category: Optional[List[str]] = Query(None),
+    tag: Optional[List[str]] = Query(None),
+    payer_id: Optional[str] = None,
+    group_id: Optional[str] = None,
+    min_amount: Optional[float] = Query(None, ge=0),
+    max_amount: Optional[float] = Query(None, ge=0),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    facets: bool = True,
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """Search expenses in every group the caller belongs to."""
+    groups = await database.db.groups.find(
+        {"members": current_user.id}, {"_id": 1}
+    ).to_list(length=None)
+    group_ids = [str(g["_id"]) for g in groups]
+    if group_id:
+        if group_id not in group_ids:
+            raise HTTPException(status_code=403, detail="User not in group")
+        group_ids = [group_id]
+
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    query = search_service.build_query(
+        group_ids,
+        q=q.strip() if q else None,
+        categories=category,
+        tags=tag,
+        payer_id=payer_id,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        start=start,
+        end=end,
+    )
+    expenses, facet_counts = await search_service.search(
+        query, limit, position, facets
     )
 
-    return ExpenseInDB(**created_expense)
+    next_cursor = None
+    if len(expenses) > limit:
+        expenses = expenses[:limit]
+        last = expenses[-1]
+        next_cursor = encode_cursor(last["date"], last["_id"])
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return ExpenseSearchResults(
+        results=[ExpenseInDB(**expense_to_api(e)) for e in expenses],
+        facets=facet_counts,
+        next_cursor=next_cursor,
+    )
 
 
 @router.get("/{expense_id}", response_model=ExpenseInDB)
@@ -50,11 +201,13 @@ async def get_expense(
         raise HTTPException(status_code=404, detail="Expense not found")
 
     # Check if user is in the group of this expense
-    group = await database.db.groups.find_one({"_id": ObjectId(expense["group_id"])})
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(expense["group_id"])}, {"members": 1}
+    )
     if not group or current_user.id not in group["members"]:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    return ExpenseInDB(**expense)
+    return ExpenseInDB(**expense_to_api(expense))
 
 
 @router.put("/{expense_id}", response_model=ExpenseInDB)
@@ -77,14 +230,39 @@ async def update_expense(
     update_data = {k: v for k, v in expense_update.dict().items() if v is not None}
 
     if not update_data:
-        return ExpenseInDB(**existing_expense)
+        return ExpenseInDB(**expense_to_api(existing_expense))
+
+    existing_amount, existing_split = expense_minor(existing_expense)
+    try:
+        update_data = expense_to_db(update_data, existing_amount)
+    except SplitMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "split_minor" not in update_data and (
+        update_data.get("amount_minor", existing_amount) != sum(existing_split.values())
+    ):
+        raise HTTPException(
+            status_code=400, detail="Split amounts do not match total amount"
+        )
 
-    await database.db.expenses.update_one(
-        {"_id": ObjectId(expense_id)}, {"$set": update_data}
+    if "payer_id" in update_data or "split_minor" in update_data:
+        update_data["participants"] = expense_participants(
+            update_data.get("payer_id", existing_expense["payer_id"]),
+            update_data.get("split_minor", existing_split),
+        )
+
+    updated_expense = await database.db.expenses.find_one_and_update(
+        {"_id": ObjectId(expense_id)},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER,
     )
+    if updated_expense is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
 
-    updated_expense = await database.db.expenses.find_one({"_id": ObjectId(expense_id)})
-    return ExpenseInDB(**updated_expense)
+    await ledger_service.replace_expense(existing_expense, updated_expense)
+    await rollup_service.replace_expense(existing_expense, updated_expense)
+    await _bump_group_version(updated_expense["group_id"])
+    await events_service.expense_changed("expense_updated", updated_expense)
+    return ExpenseInDB(**expense_to_api(updated_expense))
 
 
 @router.delete("/{expense_id}")
@@ -97,48 +275,138 @@ async def delete_expense(
     if not existing_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    # Check permission (User must be in group)
-    group = await database.db.groups.find_one(
-        {"_id": ObjectId(existing_expense["group_id"])}
-    )
-    if not group or current_user.id not in group["members"]:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    await database.db.expenses.delete_one({"_id": ObjectId(expense_id)})
+    # Check permission (User must be in group) while uncounting the expense
+    group_id = existing_expense["group_id"]
+    await _adjust_expense_count(group_id, current_user, -1, "Access denied")
 
-    # Remove from group expenses list
-    await database.db.groups.update_one(
-        {"_id": ObjectId(existing_expense["group_id"])},
-        {"$pull": {"expenses": expense_id}},
-    )
+    result = await database.db.expenses.delete_one({"_id": ObjectId(expense_id)})
+    if result.deleted_count:
+        await ledger_service.reverse_expense(existing_expense)
+        await rollup_service.reverse_expense(existing_expense)
+        await _bump_group_version(group_id)
+        await events_service.expense_changed("expense_deleted", existing_expense)
+    else:
+        # Lost a race with another delete; undo the counter change
+        await _adjust_expense_count(group_id, current_user, 1, "Access denied")
 
     return {"message": "Expense deleted successfully"}
 
 
 @router.get("/group/{group_id}", response_model=List[ExpenseInDB])
 async def get_group_expenses(
-    group_id: str, current_user: UserInDB = Depends(get_current_user)
+    group_id: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: UserInDB = Depends(get_current_user),
 ):
-    group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
+    group = await _member_group(group_id, current_user)
 
-    if current_user.id not in group["members"]:
-        raise HTTPException(status_code=403, detail="User not in group")
+    etag = weak_etag("expenses", group_id, group.get("version", 0))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
 
-    expenses_cursor = database.db.expenses.find({"group_id": group_id})
-    expenses = await expenses_cursor.to_list(length=100)
-    return [ExpenseInDB(**e) for e in expenses]
+    try:
+        projection = parse_fields(
+            fields, set(ExpenseInDB.model_fields) - {"id"}, STORED_FIELDS
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {e}")
+
+    query = group_query(group_id)
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query.update(keyset_after(*position))
+
+    # Newest first; _id breaks ties between expenses sharing a date
+    expenses_cursor = database.db.expenses.find(query, projection).sort(NEWEST_FIRST)
+    expenses = await expenses_cursor.to_list(length=limit + 1)
+
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if len(expenses) > limit:
+        expenses = expenses[:limit]
+        last = expenses[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last["date"], last["_id"])
+
+    if projection is None:
+        if FAST_SERIALIZATION:
+            rows = EXPENSE_ROWS.rows(expense_to_api(e) for e in expenses)
+            return fast_response(rows, headers)
+        response.headers.update(headers)
+        return [ExpenseInDB(**expense_to_api(e)) for e in expenses]
+
+    # Partial documents don't satisfy ExpenseInDB, so skip response_model
+    rows = partial_rows(expense_to_api(e) for e in expenses)
+    return fast_response(rows, headers)
+
+
+@router.post("/group/{group_id}/import")
+async def import_group_expenses(
+    group_id: str,
+    rows: List[dict] = Body(...),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MAX_IMPORT_ROWS} rows per import"
+        )
+
+    group = await _member_group(group_id, current_user)
+    return await import_service.import_expenses(group_id, rows, set(group["members"]))
+
+
+@router.post("/group/{group_id}/import/csv")
+async def import_group_expenses_csv(
+    group_id: str,
+    file: UploadFile = File(...),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    group = await _member_group(group_id, current_user)
+
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8 encoded")
+    finally:
+        await file.close()
+
+    names = await import_service.member_names(group["members"])
+    rows, parse_errors = import_service.parse_csv(text, names)
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MAX_IMPORT_ROWS} rows per import"
+        )
+
+    result = await import_service.import_expenses(group_id, rows, set(group["members"]))
+    result["errors"] = sorted(parse_errors + result["errors"], key=lambda e: e["row"])
+    return result
 
 
 @router.get("/group/{group_id}/balances")
 async def get_group_balances(
-    group_id: str, current_user: UserInDB = Depends(get_current_user)
+    group_id: str,
+    request: Request,
+    response: Response,
+    mode: str = "auto",
+    current_user: UserInDB = Depends(get_current_user),
 ):
-    expenses_cursor = database.db.expenses.find({"group_id": group_id})
-    expenses = await expenses_cursor.to_list(length=1000)
+    group = await _member_group(group_id, current_user)
+
+    etag = weak_etag("balances", group_id, group.get("version", 0), mode)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
+    # Read the materialized ledger (one entry per member) instead of replaying history
+    balances = await ledger_service.get_group_net_balances(group_id)
 
-    # Delegate logic to service
-    from services.balance_service import calculate_settlements
+    if mode not in SETTLEMENT_MODES:
+        raise HTTPException(status_code=400, detail="Unknown settlement mode")
 
-    return calculate_settlements(expenses)
+    return settle_balances(balances, mode)
@@ -1,22 +1,42 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 import models
 from models import (
     GroupCreate,
     GroupInDB,
     UserInDB,
     GroupWithMembers,
-    UserSummary,
     ExpenseUpdate,
 )
 import database
-from auth import get_current_user
-from typing import List
+from auth import get_current_user, get_stream_user
+from typing import List, Optional
+from datetime import datetime
+import asyncio
+import hashlib
 import uuid
 from bson import ObjectId
-from upload import delete_image_file
+from pymongo import ReturnDocument
+from upload import delete_image_file, retain_image_file
+from etag import not_modified, set_etag, weak_etag
+from serialization import FAST_SERIALIZATION, RowShaper, fast_response
+from services import (
+    analytics_service,
+    events_service,
+    export_service,
+    ledger_service,
+    rollup_service,
+    user_service,
+)
 
 router = APIRouter()
 
+# Groups written before expense_count replaced the expenses id array may still
+# carry it until `manage.py migrate group-expenses` runs; never ship it.
+GROUP_PROJECTION = {"expenses": 0}
+
+GROUP_ROWS = RowShaper(GroupInDB)
+
 
 @router.post("/create", response_model=GroupInDB)
 async def create_group(
@@ -26,61 +46,66 @@ async def create_group(
     group_data["members"] = [current_user.id]
     group_data["invite_code"] = str(uuid.uuid4())[:8]
 
-    new_group = await database.db.groups.insert_one(group_data)
-    created_group = await database.db.groups.find_one({"_id": new_group.inserted_id})
-    return GroupInDB(**created_group)
+    # insert_one sets _id on the local document, so there is no re-read
+    await database.db.groups.insert_one(group_data)
+    await ledger_service.create_group_ledger(str(group_data["_id"]))
+    await retain_image_file(group_data.get("icon"))
+    return GroupInDB(**group_data)
 
 
 @router.post("/join/{invite_code}", response_model=GroupInDB)
 async def join_group(
     invite_code: str, current_user: UserInDB = Depends(get_current_user)
 ):
-    group = await database.db.groups.find_one({"invite_code": invite_code})
+    # $addToSet leaves existing members untouched, so joining twice is a no-op
+    group = await database.db.groups.find_one_and_update(
+        {"invite_code": invite_code},
+        {"$addToSet": {"members": current_user.id}, "$inc": {"version": 1}},
+        projection=GROUP_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    if current_user.id in group["members"]:
-        return GroupInDB(**group)  # Already a member
-
-    await database.db.groups.update_one(
-        {"_id": group["_id"]}, {"$push": {"members": current_user.id}}
-    )
-
-    updated_group = await database.db.groups.find_one({"_id": group["_id"]})
-    return GroupInDB(**updated_group)
+    return GroupInDB(**group)
 
 
 @router.get("/my", response_model=List[GroupInDB])
 async def get_my_groups(current_user: UserInDB = Depends(get_current_user)):
-    groups_cursor = database.db.groups.find({"members": current_user.id})
+    groups_cursor = database.db.groups.find(
+        {"members": current_user.id}, GROUP_PROJECTION
+    )
     groups = await groups_cursor.to_list(length=100)
+    if FAST_SERIALIZATION:
+        return fast_response(GROUP_ROWS.rows(groups))
     return [GroupInDB(**g) for g in groups]
 
 
 @router.get("/{group_id}", response_model=GroupWithMembers)
 async def get_group_details(
-    group_id: str, current_user: UserInDB = Depends(get_current_user)
+    group_id: str,
+    request: Request,
+    response: Response,
+    current_user: UserInDB = Depends(get_current_user),
 ):
-    group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, GROUP_PROJECTION
+    )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
     if current_user.id not in group["members"]:
         raise HTTPException(status_code=403, detail="User not in group")
 
-    # Fetch member details
-    members_details = []
-    for member_id in group["members"]:
-        user = await database.db.users.find_one({"_id": ObjectId(member_id)})
-        if user:
-            members_details.append(
-                UserSummary(
-                    id=str(user["_id"]),
-                    name=user["name"],
-                    email=user["email"],
-                    avatar=user.get("avatar"),
-                )
-            )
+    etag = weak_etag("group", group_id, group.get("version", 0))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+
+    # Fetch member details in one query, keeping the group's member order
+    users = await user_service.resolve_users(group["members"])
+    members_details = [users[m] for m in group["members"] if m in users]
 
     group_with_members = GroupWithMembers(**group)
     group_with_members.members_details = members_details
@@ -93,35 +118,48 @@ async def update_group(
     group_update: models.GroupUpdate,
     current_user: UserInDB = Depends(get_current_user),
 ):
-    group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-
-    if current_user.id not in group["members"]:
-        raise HTTPException(status_code=403, detail="Access denied")
-
     update_data = {k: v for k, v in group_update.dict().items() if v is not None}
 
     if not update_data:
+        group = await database.db.groups.find_one(
+            {"_id": ObjectId(group_id)}, GROUP_PROJECTION
+        )
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        if current_user.id not in group["members"]:
+            raise HTTPException(status_code=403, detail="Access denied")
         return GroupInDB(**group)
 
+    # The members filter is the permission check; the pre-image tells us which
+    # icon to clean up and the post-image is built locally from it.
+    group = await database.db.groups.find_one_and_update(
+        {"_id": ObjectId(group_id), "members": current_user.id},
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection=GROUP_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if not group:
+        if await database.db.groups.count_documents(
+            {"_id": ObjectId(group_id)}, limit=1
+        ):
+            raise HTTPException(status_code=403, detail="Access denied")
+        raise HTTPException(status_code=404, detail="Group not found")
+
     # Delete old icon if it's being replaced
     if "icon" in update_data and update_data["icon"] != group.get("icon"):
-        delete_image_file(group.get("icon"))
+        await retain_image_file(update_data["icon"])
+        await delete_image_file(group.get("icon"))
 
-    await database.db.groups.update_one(
-        {"_id": ObjectId(group_id)}, {"$set": update_data}
-    )
-
-    updated_group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
-    return GroupInDB(**updated_group)
+    return GroupInDB(**{**group, **update_data, "version": group.get("version", 0) + 1})
 
 
 @router.delete("/{group_id}")
 async def delete_group(
     group_id: str, current_user: UserInDB = Depends(get_current_user)
 ):
-    group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, {"members": 1, "icon": 1}
+    )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
@@ -129,60 +167,138 @@ async def delete_group(
         raise HTTPException(status_code=403, detail="Access denied")
 
     # cascading delete expenses
+    await rollup_service.reverse_group(group_id)
     await database.db.expenses.delete_many({"group_id": group_id})
     await database.db.groups.delete_one({"_id": ObjectId(group_id)})
+    await ledger_service.drop_group_ledger(group_id)
+    events_service.group_deleted(group_id)
+    await delete_image_file(group.get("icon"))
 
     return {"message": "Group deleted successfully"}
 
 
 @router.get("/{group_id}/export")
 async def export_group_expenses(
-    group_id: str, current_user: UserInDB = Depends(get_current_user)
+    group_id: str,
+    format: str = "csv",
+    compress: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: UserInDB = Depends(get_current_user),
 ):
-    group = await database.db.groups.find_one({"_id": ObjectId(group_id)})
+    if format not in export_service.FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, {"members": 1}
+    )
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
     if current_user.id not in group["members"]:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    expenses_cursor = database.db.expenses.find({"group_id": group_id})
-    expenses = await expenses_cursor.to_list(length=1000)
+    media_type, extension = export_service.FORMATS[format]
+    filename = f"group_{group_id}_expenses.{extension}"
 
-    # Generate CSV in memory
-    import io
-    import csv
-    from fastapi.responses import StreamingResponse
+    query = export_service.build_query(group_id, start, end)
+    body = export_service.stream_expenses(query, format)
+    if compress:
+        body = export_service.gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Date", "Description", "Category", "Amount", "Payer", "Splits"])
+    response = StreamingResponse(body, media_type=media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
 
-    for exp in expenses:
-        # Get payer name
-        payer = await database.db.users.find_one({"_id": ObjectId(exp["payer_id"])})
-        payer_name = payer["name"] if payer else "Unknown"
 
-        # Format splits
-        splits_str = ", ".join(
-            [f"{uid}:{amt}" for uid, amt in exp["split_details"].items()]
-        )
+@router.get("/{group_id}/analytics")
+async def get_group_analytics(
+    group_id: str,
+    request: Request,
+    response: Response,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = Query("month", pattern="^(day|week|month)$"),
+    timezone: str = "UTC",
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """Spend by category, tag, member and day/week/month between start and end."""
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, {"members": 1, "version": 1}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
 
-        writer.writerow(
-            [
-                exp.get("date", ""),
-                exp["description"],
-                exp.get("category", "General"),
-                exp["amount"],
-                payer_name,
-                splits_str,
-            ]
-        )
+    if current_user.id not in group["members"]:
+        raise HTTPException(status_code=403, detail="Access denied")
 
-    output.seek(0)
+    if not analytics_service.valid_timezone(timezone):
+        raise HTTPException(status_code=400, detail="Invalid timezone")
 
-    response = StreamingResponse(iter([output.getvalue()]), media_type="text/csv")
-    response.headers["Content-Disposition"] = (
-        f"attachment; filename=group_{group_id}_expenses.csv"
+    # end defaults to open rather than now, so results only change with the
+    # group version; the query is hashed to keep the tag header-safe
+    version = group.get("version", 0)
+    query = hashlib.sha1(repr((start, end, interval, timezone)).encode()).hexdigest()
+    etag = weak_etag("analytics", group_id, version, query[:16])
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    analytics = await analytics_service.group_analytics(
+        group_id, version, start, end, interval, timezone
+    )
+    set_etag(response, etag)
+    return analytics
+
+
+@router.get("/{group_id}/events")
+async def group_events(
+    group_id: str, request: Request, current_user: UserInDB = Depends(get_stream_user)
+):
+    """Server-Sent Events: expense changes in the group and the balances after them."""
+    group = await database.db.groups.find_one(
+        {"_id": ObjectId(group_id)}, {"members": 1}
+    )
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    if current_user.id not in group["members"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    hub = events_service.hub
+
+    async def stream():
+        # Subscribed once the response iterates, so a stream that never starts
+        # can't leak its queue; still ahead of the balances snapshot, so no
+        # event in between is missed
+        queue = None
+        try:
+            queue = hub.subscribe(group_id)
+            yield events_service.format_event(
+                await events_service.current_balances(group_id)
+            )
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), events_service.HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield events_service.format_event(event)
+                if event["type"] == "group_deleted":
+                    return
+        finally:
+            if queue is not None:
+                hub.unsubscribe(group_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx-style proxies from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return response
@@ -1,43 +1,52 @@
-from dotenv import load_dotenv
 from pathlib import Path
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load env before other imports
+# Load env before other imports. Deployments set real env vars and ship no
+# .env, so they skip importing dotenv entirely.
 env_path = Path(__file__).resolve().parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+if env_path.exists():
+    from dotenv import load_dotenv
 
+    load_dotenv(dotenv_path=env_path)
+
+import importlib
 import sys
 import os
 
 # Fix for Vercel: Add current directory to sys.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pymongo import monitoring
 from fastapi.middleware.cors import CORSMiddleware
+import database
 from database import connect_to_mongo, close_mongo_connection
-from auth import router as auth_router
-from groups import router as groups_router
-from expenses import router as expenses_router
-from users import router as users_router
-from upload import router as upload_router
+from indexes import ensure_indexes
+from services.user_cache import user_cache
+from errors import PasswordHasherBusy
+from rate_limit import limiter, rate_limit
+import metrics
+
+# Registered before connect_to_mongo creates the client, which picks it up
+monitoring.register(metrics.command_metrics)
 
-# Initialize Limiter
-limiter = Limiter(key_func=get_remote_address, default_limits=["200/minute"])
+# Every route, including lazily loaded ones, is rate limited per caller and route
+app = FastAPI(dependencies=[Depends(rate_limit)])
 
-app = FastAPI()
 
-# Add rate limiter
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    # Backpressure: shed auth load instead of queueing it without bound
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-in attempts, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
 
 # SECURITY: Define allowed origins. Update this list for production!
 origins = [
@@ -52,62 +61,206 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    if database.db is not None:
+        await ensure_indexes(database.db)
+
+
+def _event_hub():
+    # Only loaded along with the routers that publish to it
+    events = sys.modules.get("services.events_service")
+    return events.hub if events else None
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    hub = _event_hub()
+    if hub is not None:
+        await hub.close()
     await close_mongo_connection()
 
 
-app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
-app.include_router(groups_router, prefix="/api/groups", tags=["groups"])
-app.include_router(expenses_router, prefix="/api/expenses", tags=["expenses"])
-app.include_router(users_router, prefix="/api/users", tags=["users"])
-app.include_router(upload_router, prefix="/api/upload", tags=["upload"])
+# Routers are imported on the first request under their prefix, so a cold
+# start only pays for the modules that request needs (/api/health needs none).
+ROUTERS = {
+    "/api/auth": ("auth", "auth"),
+    "/api/groups": ("groups", "groups"),
+    "/api/expenses": ("expenses", "expenses"),
+    "/api/users": ("users", "users"),
+    "/api/upload": ("upload", "upload"),
+}
+DOC_PATHS = {app.openapi_url, app.docs_url, app.redoc_url}
+
+_loaded_routers = set()
+# Lazily added routes go here, ahead of the SPA catch-all registered below
+_router_slot = 0
+
+
+def load_router(prefix: str):
+    global _router_slot
+    if prefix in _loaded_routers:
+        return
+    module_name, tag = ROUTERS[prefix]
+    module = importlib.import_module(module_name)
+
+    before = len(app.router.routes)
+    app.include_router(module.router, prefix=prefix, tags=[tag])
+    added = app.router.routes[before:]
+    del app.router.routes[before:]
+    app.router.routes[_router_slot:_router_slot] = added
+    _router_slot += len(added)
+    _loaded_routers.add(prefix)
+
+
+def load_routers_for(path: str):
+    if path in DOC_PATHS:
+        for prefix in ROUTERS:
+            load_router(prefix)
+        return
+    for prefix in ROUTERS:
+        if path == prefix or path.startswith(prefix + "/"):
+            load_router(prefix)
+            return
+
+
+class LazyRouterMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            load_routers_for(scope["path"])
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(LazyRouterMiddleware)
+# Outermost, so its timings include every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.get("/api/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    """Public liveness check: status and database reachability only. Process
+    internals are on the token-gated /api/metrics."""
+    mongo = await database.ping()
+    if not mongo["ok"]:
+        # Driver errors can name hosts; they go to the log, not the response
+        print(f"Health check: MongoDB unavailable: {mongo.get('error')}")
+    body = {
+        "status": "ok" if mongo["ok"] else "unavailable",
+        "mongo": {"ok": mongo["ok"], "latency_ms": mongo.get("latency_ms")},
+    }
+    return JSONResponse(status_code=200 if mongo["ok"] else 503, content=body)
+
+
+@app.get("/api/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    """Prometheus text exposition of request, Mongo and pool metrics."""
+    if metrics.METRICS_TOKEN:
+        authorization = request.headers.get("authorization", "")
+        if authorization != f"Bearer {metrics.METRICS_TOKEN}":
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+    pool = database.pool_stats.snapshot()
+    cache = user_cache.stats()
+    limits = limiter.stats()
+    hub = _event_hub()
+    events = hub.stats() if hub else {"groups": 0, "streams": 0, "change_streams": 0}
+    gauge = metrics.gauge
+    body = metrics.registry.render() + "".join(
+        [
+            gauge("mongo_pool_connections", "Open pooled connections.", pool["open"]),
+            gauge(
+                "mongo_pool_checked_out",
+                "Pooled connections in use.",
+                pool["checked_out"],
+            ),
+            gauge(
+                "mongo_pool_checkouts_total",
+                "Connection checkouts.",
+                pool["checkouts"],
+                "counter",
+            ),
+            gauge(
+                "mongo_pool_checkout_failures_total",
+                "Connection checkouts that failed.",
+                pool["checkout_failures"],
+                "counter",
+            ),
+            gauge(
+                "mongo_pool_wait_max_seconds",
+                "Longest wait for a pooled connection.",
+                pool["wait_ms_max"] / 1000,
+            ),
+            gauge(
+                "user_cache_entries",
+                "Users held by the auth cache.",
+                cache.get("size", 0),
+            ),
+            gauge(
+                "user_cache_hits_total", "Auth cache hits.", cache["hits"], "counter"
+            ),
+            gauge(
+                "user_cache_misses_total",
+                "Auth cache misses.",
+                cache["misses"],
+                "counter",
+            ),
+            gauge(
+                "rate_limit_windows",
+                "Rate limit windows tracked by this process.",
+                limits["windows"],
+            ),
+            gauge(
+                "rate_limit_pending_hits",
+                "Hits not yet synced to the shared store.",
+                limits["pending"],
+            ),
+            gauge(
+                "event_stream_groups",
+                "Groups with open event streams.",
+                events["groups"],
+            ),
+            gauge("event_streams", "Open event streams.", events["streams"]),
+            gauge(
+                "event_change_streams",
+                "1 while events come from MongoDB change streams.",
+                int(events["change_streams"]),
+            ),
+        ]
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+import static_files
+
+UPLOADS_DIR = Path(__file__).resolve().parent / "uploads"
+
+
+# Uploads don't depend on the frontend build, so they are always served
+@app.api_route("/uploads/{name}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_upload(name: str, request: Request):
+    return await static_files.serve_upload(request, UPLOADS_DIR, name)
+
 
 # Point to the client/dist directory
 # Ensure we go up from api/ directory to root, then into client/dist
 DIST_DIR = Path(__file__).resolve().parent.parent / "client" / "dist"
 
 if DIST_DIR.exists():
-    app.mount("/assets", StaticFiles(directory=DIST_DIR / "assets"), name="assets")
-
-    # Mount uploads directory to serve uploaded images
-    UPLOADS_DIR = Path(__file__).resolve().parent / "uploads"
-    if UPLOADS_DIR.exists():
-        app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
-
-    @app.get("/{full_path:path}")
-    async def serve_react_app(full_path: str):
-        # Allow API routes to pass through if they weren't matched above?
-        # Actually FastAPI matches in order. Since this is at bottom, it catches everything else.
-        # But we valid API routes are already matched.
-        # What about 404s for API? They will fall here and return index.html.
-        # That's acceptable for now, or we can check if full_path starts with "api".
-        if full_path.startswith("api"):
-            from fastapi import HTTPException
-
-            raise HTTPException(status_code=404, detail="Not Found")
-
-        file_path = DIST_DIR / full_path
-        if file_path.exists() and file_path.is_file():
-            return FileResponse(file_path)
-
-        return FileResponse(DIST_DIR / "index.html")
+    # Listed on the first request for it, so API cold starts don't pay for it
+    dist_manifest = static_files.DistManifest(DIST_DIR)
+
+    @app.api_route(
+        "/{full_path:path}", methods=["GET", "HEAD"], include_in_schema=False
+    )
+    async def serve_react_app(full_path: str, request: Request):
+        return await static_files.serve_dist(request, dist_manifest, full_path)
 else:
     print(f"Dist directory {DIST_DIR} not found. Build frontend first.")
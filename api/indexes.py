@@ -0,0 +1,229 @@
+"""Declared MongoDB indexes for every hot query path.
+
+``ensure_indexes`` runs at startup; ``index_report`` and ``check_query_plans``
+back the ``manage.py indexes`` commands.
+"""
+
+from typing import Dict, List
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # auth.get_current_user runs this lookup on every authenticated request
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "groups": [
+        IndexModel(
+            [("invite_code", ASCENDING)], name="invite_code_unique", unique=True
+        ),
+        IndexModel([("members", ASCENDING)], name="members"),
+    ],
+    "expenses": [
+        # Group listing (keyset on date, _id), export, analytics date ranges
+        # and ledger replay
+        IndexModel(
+            [("group_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+            name="group_date",
+        ),
+        # Per-user stats and feeds: payer plus split users, see expense_service
+        IndexModel(
+            [("participants", ASCENDING), ("date", DESCENDING)],
+            name="participants_date",
+        ),
+        # expenses.search_expenses: word matches on descriptions
+        IndexModel([("description", TEXT)], name="description_text"),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING), ("month", ASCENDING)], name="user_month"),
+    ],
+    "uploads": [
+        # manage.py uploads prune: images never attached to a user or group
+        IndexModel(
+            [("refs", ASCENDING), ("created_at", ASCENDING)], name="refs_created"
+        ),
+    ],
+    "rate_limits": [
+        # Drops counter windows once they can no longer affect a decision
+        IndexModel(
+            [("expires_at", ASCENDING)], name="expires_ttl", expireAfterSeconds=0
+        ),
+    ],
+}
+
+
+def _declared_names(collection: str) -> set:
+    return {model.document["name"] for model in INDEXES.get(collection, [])}
+
+
+async def ensure_indexes(db) -> List[str]:
+    """Create any declared index that is missing. Returns the failures.
+
+    A failure (e.g. duplicate emails blocking a unique index) is reported but
+    never stops the app from starting.
+    """
+    failures = []
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            failures.append(f"{collection}: {e}")
+            print(f"Failed to create indexes on {collection}: {e}")
+    return failures
+
+
+async def index_report(db) -> dict:
+    """List declared indexes that are missing and existing ones never used.
+
+    Usage counts come from $indexStats and reset when mongod restarts.
+    """
+    missing = []
+    unused = []
+    undeclared = []
+    for collection in INDEXES:
+        existing = await db[collection].index_information()
+        for name in _declared_names(collection) - set(existing):
+            missing.append(f"{collection}.{name}")
+
+        for name in set(existing) - _declared_names(collection) - {"_id_"}:
+            undeclared.append(f"{collection}.{name}")
+
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure:
+            continue
+        for stat in stats:
+            if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0:
+                unused.append(f"{collection}.{stat['name']}")
+
+    return {
+        "missing": sorted(missing),
+        "unused": sorted(unused),
+        "undeclared": sorted(undeclared),
+    }
+
+
+def _representative_queries() -> List[dict]:
+    """The filters the routers actually send, with placeholder values.
+
+    Expense and rollup filters come from the builders the query sites use; an
+    aggregation is checked through the filter of its leading $match.
+    """
+    # Imported here so the services stay out of the app's cold start
+    from services import analytics_service, rollup_service
+    from services import search_service, stats_service
+    from services.expense_service import (
+        NEWEST_FIRST,
+        OLDEST_FIRST,
+        group_query,
+        participant_query,
+    )
+
+    uid = str(ObjectId())
+    gid = str(ObjectId())
+    since = datetime(2020, 1, 1)
+
+    def leading_match(pipeline: list) -> dict:
+        return pipeline[0]["$match"]
+
+    expense_match, rollup_match = rollup_service.scope(uid)
+    return [
+        {
+            "name": "auth.get_current_user",
+            "collection": "users",
+            "filter": {"email": "someone@example.com"},
+        },
+        {
+            "name": "groups.join_group",
+            "collection": "groups",
+            "filter": {"invite_code": "abcd1234"},
+        },
+        {
+            "name": "groups.get_my_groups",
+            "collection": "groups",
+            "filter": {"members": uid},
+        },
+        {
+            "name": "expenses.get_group_expenses",
+            "collection": "expenses",
+            "filter": group_query(gid),
+            "sort": NEWEST_FIRST,
+        },
+        {
+            "name": "groups.export_group_expenses",
+            "collection": "expenses",
+            "filter": group_query(gid, since),
+            "sort": OLDEST_FIRST,
+        },
+        {
+            "name": "groups.get_group_analytics",
+            "collection": "expenses",
+            "filter": leading_match(
+                analytics_service.build_pipeline(gid, since, None, "month", "UTC")
+            ),
+        },
+        {
+            "name": "expenses.search_expenses",
+            "collection": "expenses",
+            "filter": search_service.build_query([gid]),
+            "sort": NEWEST_FIRST,
+        },
+        {
+            "name": "expenses.search_expenses (q)",
+            "collection": "expenses",
+            "filter": search_service.build_query([gid], q="dinner"),
+        },
+        {
+            "name": "ledger_service.rebuild_group_ledger",
+            "collection": "expenses",
+            "filter": group_query(gid),
+        },
+        {
+            "name": "users.get_user_stats (recent)",
+            "collection": "expenses",
+            "filter": participant_query(uid),
+            "sort": stats_service.RECENT_SORT,
+        },
+        {
+            "name": "users.get_user_stats (rollups)",
+            "collection": rollup_service.ROLLUP_COLLECTION,
+            "filter": rollup_match,
+            "sort": rollup_service.ROLLUP_SORT,
+        },
+        {
+            "name": "rollup_service.rebuild (user)",
+            "collection": "expenses",
+            "filter": leading_match(rollup_service.build_pipeline(expense_match, uid)),
+        },
+        {
+            "name": "rollup_service.reverse_group",
+            "collection": "expenses",
+            "filter": leading_match(rollup_service.build_pipeline(group_query(gid))),
+        },
+    ]
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+async def check_query_plans(db) -> List[dict]:
+    """Explain each router query and return the ones whose plan has a COLLSCAN."""
+    offenders = []
+    for query in _representative_queries():
+        cursor = db[query["collection"]].find(query["filter"])
+        if "sort" in query:
+            cursor = cursor.sort(query["sort"])
+        explain = await cursor.explain()
+        winning = explain["queryPlanner"]["winningPlan"]
+        stages = [s for s in _stages(winning) if s]
+        if "COLLSCAN" in stages:
+            offenders.append({"name": query["name"], "stages": stages})
+    return offenders
@@ -0,0 +1,250 @@
+"""Maintenance commands for the API database.
+
+Usage:
+    python manage.py ledger rebuild [--group GROUP_ID]
+    python manage.py ledger verify [--group GROUP_ID]
+    python manage.py indexes ensure
+    python manage.py indexes report
+    python manage.py indexes explain
+    python manage.py migrate participants
+    python manage.py migrate money
+    python manage.py migrate group-expenses
+    python manage.py stats rebuild [--user USER_ID]
+    python manage.py stats verify [--user USER_ID]
+    python manage.py uploads prune
+    python manage.py static compress
+"""
+
+from dotenv import load_dotenv
+from pathlib import Path
+import argparse
+import asyncio
+import sys
+import os
+
+# Load env the same way index.py does, before database reads MONGODB_URL
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import database  # noqa: E402
+import indexes  # noqa: E402
+import static_files  # noqa: E402
+from money import to_major  # noqa: E402
+from services import (  # noqa: E402
+    expense_service,
+    image_service,
+    ledger_service,
+    rollup_service,
+)
+
+
+async def ledger_rebuild(args) -> int:
+    count = await ledger_service.rebuild_all(args.group)
+    print(f"Rebuilt ledger for {count} group(s)")
+    return 0
+
+
+async def ledger_verify(args) -> int:
+    report = await ledger_service.verify_all(args.group)
+    if not report:
+        print("Ledger is consistent with expense history")
+        return 0
+
+    for group_id, drift in report.items():
+        print(f"Group {group_id}:")
+        for row in drift:
+            # Balances are kept in minor units
+            print(
+                f"  {row['user_id']}: stored={to_major(row['stored']):.2f} "
+                f"expected={to_major(row['expected']):.2f}"
+            )
+    return 1
+
+
+async def indexes_ensure(args) -> int:
+    failures = await indexes.ensure_indexes(database.db)
+    if failures:
+        return 1
+    print("All declared indexes exist")
+    return 0
+
+
+async def indexes_report(args) -> int:
+    report = await indexes.index_report(database.db)
+    for kind in ("missing", "unused", "undeclared"):
+        print(f"{kind}: {', '.join(report[kind]) or '-'}")
+    return 1 if report["missing"] else 0
+
+
+async def indexes_explain(args) -> int:
+    offenders = await indexes.check_query_plans(database.db)
+    for offender in offenders:
+        print(f"COLLSCAN in {offender['name']}: {' <- '.join(offender['stages'])}")
+    if offenders:
+        return 1
+    print("No router query uses a collection scan")
+    return 0
+
+
+async def migrate_participants(args) -> int:
+    count = await expense_service.backfill_participants()
+    print(f"Backfilled participants on {count} expense(s)")
+    return 0
+
+
+async def stats_rebuild(args) -> int:
+    try:
+        count = await rollup_service.rebuild(args.user)
+    except rollup_service.MigrationPending as e:
+        print(e)
+        return 1
+    print(f"Rebuilt {count} user/month rollup(s)")
+    return 0
+
+
+async def stats_verify(args) -> int:
+    try:
+        drift = await rollup_service.verify(args.user)
+    except rollup_service.MigrationPending as e:
+        print(e)
+        return 1
+    if not drift:
+        print("User stats rollups are consistent with expense history")
+        return 0
+
+    for row in drift:
+        print(
+            f"{row['user_id']} {row['month']}: "
+            f"stored={row['stored']} expected={row['expected']}"
+        )
+    return 1
+
+
+async def migrate_money(args) -> int:
+    count = await expense_service.migrate_money()
+    print(f"Converted {count} expense(s) to minor units")
+    # The rollup rebuild unwinds participants; without them an expense is lost
+    backfilled = await expense_service.backfill_participants()
+    print(f"Backfilled participants on {backfilled} expense(s)")
+    groups = await ledger_service.rebuild_all()
+    try:
+        rollups = await rollup_service.rebuild()
+    except rollup_service.MigrationPending as e:
+        print(e)
+        return 1
+    print(f"Rebuilt ledger for {groups} group(s) and {rollups} stats rollup(s)")
+    return 0
+
+
+async def migrate_group_expenses(args) -> int:
+    count = await expense_service.migrate_group_expense_counts()
+    print(f"Set expense_count on {count} group(s) with expenses")
+    return 0
+
+
+async def uploads_prune(args) -> int:
+    count = await image_service.prune_orphans()
+    print(f"Removed {count} unreferenced upload(s)")
+    return 0
+
+
+async def static_compress(args) -> int:
+    dist = Path(__file__).resolve().parent.parent / "client" / "dist"
+    if not dist.exists():
+        print(f"{dist} not found, build the frontend first")
+        return 1
+    written = static_files.precompress(dist)
+    print(f"Wrote {len(written)} precompressed file(s)")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ledger = commands.add_parser("ledger", help="Per-group balance ledger")
+    ledger_commands = ledger.add_subparsers(dest="action", required=True)
+
+    rebuild = ledger_commands.add_parser("rebuild", help="Replay history into ledger")
+    rebuild.add_argument("--group", help="Only this group id")
+    rebuild.set_defaults(handler=ledger_rebuild)
+
+    verify = ledger_commands.add_parser("verify", help="Check ledger against history")
+    verify.add_argument("--group", help="Only this group id")
+    verify.set_defaults(handler=ledger_verify)
+
+    index_parser = commands.add_parser("indexes", help="Declared MongoDB indexes")
+    index_commands = index_parser.add_subparsers(dest="action", required=True)
+    index_commands.add_parser("ensure", help="Create missing indexes").set_defaults(
+        handler=indexes_ensure
+    )
+    index_commands.add_parser(
+        "report", help="Show missing and unused indexes"
+    ).set_defaults(handler=indexes_report)
+    index_commands.add_parser(
+        "explain", help="Fail if a router query does a COLLSCAN"
+    ).set_defaults(handler=indexes_explain)
+
+    migrate = commands.add_parser("migrate", help="One-off data migrations")
+    migrate_commands = migrate.add_subparsers(dest="action", required=True)
+    migrate_commands.add_parser(
+        "participants", help="Add participants arrays to existing expenses"
+    ).set_defaults(handler=migrate_participants)
+    migrate_commands.add_parser(
+        "money", help="Store expense amounts as integer minor units"
+    ).set_defaults(handler=migrate_money)
+    migrate_commands.add_parser(
+        "group-expenses", help="Replace groups.expenses arrays with a counter"
+    ).set_defaults(handler=migrate_group_expenses)
+
+    stats = commands.add_parser("stats", help="Per-user monthly stats rollups")
+    stats_commands = stats.add_subparsers(dest="action", required=True)
+
+    stats_rebuild_parser = stats_commands.add_parser(
+        "rebuild", help="Recompute rollups from expenses"
+    )
+    stats_rebuild_parser.add_argument("--user", help="Only this user id")
+    stats_rebuild_parser.set_defaults(handler=stats_rebuild)
+
+    stats_verify_parser = stats_commands.add_parser(
+        "verify", help="Report rollup drift against expenses"
+    )
+    stats_verify_parser.add_argument("--user", help="Only this user id")
+    stats_verify_parser.set_defaults(handler=stats_verify)
+
+    uploads = commands.add_parser("uploads", help="Content-addressed image uploads")
+    uploads_commands = uploads.add_subparsers(dest="action", required=True)
+    uploads_commands.add_parser(
+        "prune", help="Delete uploads no user or group references"
+    ).set_defaults(handler=uploads_prune)
+
+    static = commands.add_parser("static", help="Built frontend in client/dist")
+    static_commands = static.add_subparsers(dest="action", required=True)
+    static_commands.add_parser(
+        "compress", help="Write .br/.gz siblings for text assets"
+    ).set_defaults(handler=static_compress, needs_db=False)
+
+    return parser
+
+
+async def run(args) -> int:
+    if not getattr(args, "needs_db", True):
+        return await args.handler(args)
+    await database.connect_to_mongo()
+    if database.db is None:
+        return 2
+    try:
+        return await args.handler(args)
+    finally:
+        await database.close_mongo_connection()
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""Request and MongoDB metrics, exposed as Prometheus text on /api/metrics.
+
+``MetricsMiddleware`` times every request under its route template and keeps a
+per-request ``RequestStats`` in a context variable. ``CommandMetrics`` is a
+PyMongo command listener. Motor runs commands in worker threads that inherit
+the caller's context, so each command is charged both to the global command
+metrics and to the request that sent it.
+
+Queries per request are recorded as a histogram per route, so an N+1 pattern
+shows up as a route whose query count grows with the data. A request slower
+than SLOW_REQUEST_MS is logged with the commands it ran, and every response
+carries a ``Server-Timing`` header with its database time and query count.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from contextvars import ContextVar
+import logging
+import os
+import threading
+import time
+from fastapi import Request
+from pymongo import monitoring
+from rate_limit import route_template
+
+logger = logging.getLogger("metrics")
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+# Commands listed per request; later ones are only counted
+MAX_RECORDED_COMMANDS = 50
+# When set, /api/metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Label for requests no route matched. Paths the SPA catch-all serves share
+# rate_limit.CATCH_ALL_ROUTE, so scanners can't add label values either way.
+UNMATCHED = "<unmatched>"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            value = _format_number(value)
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> (per-bucket counts, sum, count)
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = _format_labels(labels, ("le", _format_number(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(labels, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Every metric in the process. Command listeners report from PyMongo's
+    threads, hence the lock around updates and rendering."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, buckets: Tuple[float, ...]
+    ) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "Requests by method, route template and status."
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds",
+    "Request latency by method and route template.",
+    LATENCY_BUCKETS,
+)
+http_db_queries = registry.histogram(
+    "http_request_db_queries",
+    "MongoDB commands sent per request, by method and route template.",
+    QUERY_COUNT_BUCKETS,
+)
+http_db_time = registry.histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in MongoDB commands per request, by method and route template.",
+    LATENCY_BUCKETS,
+)
+http_slow_requests = registry.counter(
+    "http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS."
+)
+mongo_commands = registry.counter(
+    "mongo_commands_total", "MongoDB commands by name, collection and outcome."
+)
+mongo_latency = registry.histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency by name and collection.",
+    COMMAND_BUCKETS,
+)
+
+
+class RequestStats:
+    """Commands one request sent. Mutated from Motor's worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.commands: List[Tuple[str, str, float]] = []
+
+    def record(self, command: str, collection: str, seconds: float):
+        with self.lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+            if len(self.commands) < MAX_RECORDED_COMMANDS:
+                self.commands.append((command, collection, seconds))
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (connection, request id) -> (collection, request stats) until it ends
+        self._pending: Dict[tuple, tuple] = {}
+
+    def _key(self, event) -> tuple:
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        # getMore names the cursor id; its collection is a separate field
+        collection = event.command.get("collection", target)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._pending[self._key(event)] = (collection, current_request.get())
+
+    def _finished(self, event, outcome: str):
+        with self._lock:
+            collection, stats = self._pending.pop(self._key(event), ("", None))
+        seconds = event.duration_micros / 1e6
+        labels = (("command", event.command_name), ("collection", collection))
+        with registry.lock:
+            mongo_commands.inc(labels + (("outcome", outcome),))
+            mongo_latency.observe(labels, seconds)
+        if stats is not None:
+            stats.record(event.command_name, collection, seconds)
+
+    def succeeded(self, event):
+        self._finished(event, "ok")
+
+    def failed(self, event):
+        self._finished(event, "error")
+
+
+command_metrics = CommandMetrics()
+
+
+def gauge(name: str, help: str, value: float, kind: str = "gauge") -> str:
+    """Exposition lines for a value read when rendering. ``kind="counter"``
+    for running totals kept elsewhere (e.g. cache hits)."""
+    return (
+        f"# HELP {name} {help}\n# TYPE {name} {kind}\n"
+        f"{name} {_format_number(value)}\n"
+    )
+
+
+def _server_timing(stats: RequestStats) -> Tuple[bytes, bytes]:
+    value = f'db;dur={1000 * stats.db_seconds:.1f};desc="{stats.db_queries} queries"'
+    return b"server-timing", value.encode("latin-1")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_with_timing(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                streaming = (b"content-type", b"text/event-stream") in [
+                    (k.lower(), v.split(b";")[0]) for k, v in headers
+                ]
+                headers.append(_server_timing(stats))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            self._observe(scope, stats, status, streaming, started)
+
+    def _observe(self, scope, stats, status, streaming, started):
+        elapsed = time.perf_counter() - started
+        route = route_template(Request(scope)) or UNMATCHED
+        labels = (("method", scope["method"]), ("route", route))
+        with registry.lock:
+            http_requests.inc(labels + (("status", str(status)),))
+            # An event stream lasts as long as the client stays connected
+            if not streaming:
+                http_latency.observe(labels, elapsed)
+            http_db_queries.observe(labels, stats.db_queries)
+            http_db_time.observe(labels, stats.db_seconds)
+            slow = not streaming and elapsed * 1000 > SLOW_REQUEST_MS
+            if slow:
+                http_slow_requests.inc(labels)
+
+        if slow:
+            queries = ", ".join(
+                f"{command} {collection} {1000 * seconds:.1f}ms"
+                for command, collection, seconds in stats.commands
+            )
+            logger.warning(
+                "Slow request %s %s: %.0f ms, %d queries (%.1f ms in db): %s",
+                scope["method"],
+                route,
+                elapsed * 1000,
+                stats.db_queries,
+                stats.db_seconds * 1000,
+                queries or "-",
+            )
@@ -64,7 +64,8 @@ class UserSummary(BaseModel):
 class GroupInDB(GroupBase):
     id: Optional[PyObjectId] = Field(None, alias="_id")
     members: List[str] = []
-    expenses: List[str] = []
+    expense_count: int = 0
+    version: int = 0  # bumped by every group/expense mutation, drives ETags
     invite_code: str
     icon: Optional[str] = None
 
@@ -104,3 +105,22 @@ class ExpenseInDB(ExpenseBase):
     payer_id: str
     group_id: str
     split_details: dict
+    participants: List[str] = []  # payer + split users, indexed
+
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+
+class ExpenseSearchFacets(BaseModel):
+    total: int
+    categories: List[FacetCount] = []
+    tags: List[FacetCount] = []
+    payers: List[FacetCount] = []
+
+
+class ExpenseSearchResults(BaseModel):
+    results: List[ExpenseInDB] = []
+    facets: Optional[ExpenseSearchFacets] = None  # first page only
+    next_cursor: Optional[str] = None
@@ -0,0 +1,122 @@
+"""Integer minor-unit money handling.
+
+Expenses are stored as ``amount_minor`` (int) and ``split_minor``
+({user_id: int}); the API keeps speaking ``amount``/``split_details`` in major
+units. Conversion happens only here, at the boundary.
+"""
+
+from typing import Dict, Optional, Tuple
+import math
+
+MINOR_PER_MAJOR = 100
+
+# API field -> stored field, for projections
+STORED_FIELDS = {"amount": "amount_minor", "split_details": "split_minor"}
+
+
+class SplitMismatch(ValueError):
+    """Split amounts do not add up to the expense amount."""
+
+
+def to_minor(amount: float) -> int:
+    """Convert a currency amount to integer minor units (cents/paise)."""
+    return int(round(float(amount) * MINOR_PER_MAJOR))
+
+
+def to_major(minor: int) -> float:
+    return minor / MINOR_PER_MAJOR
+
+
+def split_to_minor(
+    amount_minor: int, split_details: Dict[str, float]
+) -> Dict[str, int]:
+    """Convert a split to minor units that sum exactly to ``amount_minor``.
+
+    Clients send unrounded shares (an equal three-way split of 100 arrives as
+    33.333...). Each share is floored and the leftover units go to the shares
+    with the largest remainders. Only float-rounding residue is absorbed this
+    way; a split whose shares don't add up to the amount is rejected.
+    """
+    exact = {
+        str(uid): float(share) * MINOR_PER_MAJOR for uid, share in split_details.items()
+    }
+    if abs(sum(exact.values()) - amount_minor) > len(exact) + 1e-6:
+        raise SplitMismatch("Split amounts do not match total amount")
+
+    floors = {uid: math.floor(value + 1e-6) for uid, value in exact.items()}
+    leftover = amount_minor - sum(floors.values())
+    if not 0 <= leftover <= max(len(floors) - 1, 0):
+        raise SplitMismatch("Split amounts do not match total amount")
+
+    by_remainder = sorted(exact, key=lambda uid: exact[uid] - floors[uid], reverse=True)
+    for uid in by_remainder[:leftover]:
+        floors[uid] += 1
+    return floors
+
+
+def legacy_split_to_minor(
+    amount_minor: int, split_details: Dict[str, float]
+) -> Dict[str, int]:
+    """``split_to_minor`` for float splits stored before validation existed.
+
+    Splits that really don't add up can't be repaired, so their shares are
+    rounded one by one instead of being rejected.
+    """
+    try:
+        return split_to_minor(amount_minor, split_details)
+    except SplitMismatch:
+        return {str(uid): to_minor(share) for uid, share in split_details.items()}
+
+
+def rebalance_split(amount_minor: int, split_minor: Dict[str, int]) -> Dict[str, int]:
+    """Spread a rounding residue left by per-share rounding over the split.
+
+    Fixes splits converted one share at a time (three shares of 100/3 stored
+    as 3333 each against 10000). A gap of a unit or more per share is not
+    rounding, so such splits come back unchanged.
+    """
+    residue = amount_minor - sum(split_minor.values())
+    if not residue or abs(residue) >= len(split_minor):
+        return split_minor
+    step = 1 if residue > 0 else -1
+    # Largest shares first, ties by user id, so reruns pick the same shares
+    order = sorted(split_minor, key=lambda uid: (-split_minor[uid], uid))
+    fixed = dict(split_minor)
+    for uid in order[: abs(residue)]:
+        fixed[uid] += step
+    return fixed
+
+
+def expense_minor(expense: dict) -> Tuple[int, Dict[str, int]]:
+    """(amount, split) in minor units for a stored expense document."""
+    if "amount_minor" in expense:
+        return expense["amount_minor"], expense.get("split_minor", {})
+    # Not yet migrated by ``manage.py migrate money``
+    amount_minor = to_minor(expense["amount"])
+    return amount_minor, legacy_split_to_minor(
+        amount_minor, expense.get("split_details", {})
+    )
+
+
+def expense_to_db(data: dict, amount_minor: Optional[int] = None) -> dict:
+    """Replace API money fields in ``data`` with their stored minor-unit form.
+
+    ``amount_minor`` is the stored amount to validate a split against when
+    ``data`` is a partial update that doesn't carry ``amount`` itself.
+    """
+    if "amount" in data:
+        amount_minor = data["amount_minor"] = to_minor(data.pop("amount"))
+    if "split_details" in data:
+        data["split_minor"] = split_to_minor(amount_minor, data.pop("split_details"))
+    return data
+
+
+def expense_to_api(doc: dict) -> dict:
+    """Replace stored minor-unit fields with API amounts. Works on projections."""
+    if "amount_minor" in doc:
+        doc["amount"] = to_major(doc.pop("amount_minor"))
+    if "split_minor" in doc:
+        doc["split_details"] = {
+            uid: to_major(share) for uid, share in doc.pop("split_minor").items()
+        }
+    return doc
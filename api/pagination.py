@@ -0,0 +1,53 @@
+from typing import Optional, Tuple
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(date: datetime, doc_id: ObjectId) -> str:
+    raw = f"{date.isoformat()}|{doc_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Optional[Tuple[datetime, ObjectId]]:
+    """Return (date, _id) for a cursor token, or None if it is malformed."""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8")
+        date_str, id_str = raw.split("|", 1)
+        return datetime.fromisoformat(date_str), ObjectId(id_str)
+    except (ValueError, InvalidId, UnicodeError):
+        return None
+
+
+def keyset_after(date: datetime, doc_id: ObjectId) -> dict:
+    """Filter for rows strictly after (date, _id) in descending order."""
+    return {
+        "$or": [
+            {"date": {"$lt": date}},
+            {"date": date, "_id": {"$lt": doc_id}},
+        ]
+    }
+
+
+def parse_fields(
+    fields: Optional[str], allowed: set, renames: Optional[dict] = None
+) -> Optional[dict]:
+    """Turn a comma-separated ``fields=`` value into a Mongo projection.
+
+    ``renames`` maps API field names to the stored field they come from.
+    """
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - allowed
+    if unknown:
+        raise ValueError(", ".join(sorted(unknown)))
+    renames = renames or {}
+    projection = {renames.get(f, f): 1 for f in wanted}
+    # The keyset cursor is built from these, so they are always returned
+    projection["date"] = 1
+    return projection
@@ -0,0 +1,274 @@
+"""Rate limiting shared by every worker and serverless instance.
+
+Each request is counted against ``<budget>:<caller>:<METHOD> <route>``, where the
+caller is the authenticated user id (or the client IP without a valid token).
+Budgets differ for reads, writes, sign-in and other expensive routes.
+
+Counts use a sliding window: the previous fixed window's total, weighted by
+how much of it still overlaps, plus the current window's. Totals live in a
+shared store (the ``rate_limits`` TTL collection by default). Each process
+decides from the last totals it synced plus its own unsynced hits, and
+pushes those hits as one bulk write at most every RATE_LIMIT_SYNC_SECONDS.
+Across N instances a caller can therefore overshoot by up to that interval's
+worth of traffic per instance.
+"""
+
+from typing import Dict, Optional, Protocol, Tuple
+from datetime import datetime
+import asyncio
+import contextvars
+import math
+import os
+import time
+from fastapi import HTTPException, Request
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import database
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+def parse_rate(rate: str) -> Tuple[int, int]:
+    """``"60/minute"`` -> (60, 60): requests allowed per window of seconds."""
+    count, period = rate.split("/", 1)
+    return int(count), PERIODS[period.strip()]
+
+
+RATE_LIMITS = {
+    "read": parse_rate(os.getenv("RATE_LIMIT_READ", "300/minute")),
+    "write": parse_rate(os.getenv("RATE_LIMIT_WRITE", "60/minute")),
+    "expensive": parse_rate(os.getenv("RATE_LIMIT_EXPENSIVE", "10/minute")),
+    # Sign-in is keyed by IP, which a whole office or household can share;
+    # the hashing pool's own backpressure (PasswordHasherBusy) sheds bursts
+    "auth": parse_rate(os.getenv("RATE_LIMIT_AUTH", "60/minute")),
+}
+
+AUTH_ROUTES = {
+    ("POST", "/api/auth/login"),
+    ("POST", "/api/auth/register"),
+}
+# Routes that cost far more than an ordinary write: whole-group exports and
+# imports, file uploads
+EXPENSIVE_ROUTES = {
+    ("GET", "/api/groups/{group_id}/export"),
+    ("POST", "/api/expenses/group/{group_id}/import"),
+    ("POST", "/api/expenses/group/{group_id}/import/csv"),
+    ("POST", "/api/upload/"),
+}
+EXEMPT_ROUTES = {"/api/health", "/api/metrics"}
+# One key for every path a catch-all route serves
+CATCH_ALL_ROUTE = "<catch-all>"
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+RATE_LIMIT_SYNC_SECONDS = float(os.getenv("RATE_LIMIT_SYNC_SECONDS", "1"))
+# Behind a proxy every caller shares the proxy's address. Vercel (which sets
+# VERCEL) overwrites X-Forwarded-For with the real client, so trust it there.
+RATE_LIMIT_TRUST_PROXY = (
+    os.getenv("RATE_LIMIT_TRUST_PROXY", "1" if os.getenv("VERCEL") else "0") == "1"
+)
+
+
+class CounterStore(Protocol):
+    """Shared hit counters. Implement this for another store (e.g. Redis)."""
+
+    async def sync(
+        self, increments: Dict[str, int], expires: Dict[str, float]
+    ) -> Dict[str, int]:
+        """Add ``increments`` and return the totals of every key in ``expires``."""
+        ...
+
+
+class LocalCounterStore:
+    """Single-process store, used until Mongo is connected."""
+
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+
+    async def sync(self, increments, expires):
+        for key, count in increments.items():
+            self._counts[key] = self._counts.get(key, 0) + count
+        for key in list(self._counts):
+            if key not in expires:
+                del self._counts[key]
+        return {key: self._counts.get(key, 0) for key in expires}
+
+
+class MongoCounterStore:
+    """One document per key and window; a TTL index on ``expires_at`` removes
+    windows that no longer matter (see indexes.py)."""
+
+    async def sync(self, increments, expires):
+        collection = database.db[RATE_LIMITS_COLLECTION]
+        ops = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$inc": {"count": count},
+                    "$setOnInsert": {
+                        "expires_at": datetime.utcfromtimestamp(expires[key])
+                    },
+                },
+                upsert=True,
+            )
+            for key, count in increments.items()
+        ]
+        if ops:
+            await collection.bulk_write(ops, ordered=False)
+        cursor = collection.find({"_id": {"$in": list(expires)}}, {"count": 1})
+        return {doc["_id"]: doc["count"] async for doc in cursor}
+
+
+class SlidingWindowLimiter:
+    def __init__(self, store: Optional[CounterStore] = None):
+        self.store = store
+        self._local = LocalCounterStore()
+        self._synced: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}
+        # key -> epoch seconds after which its window is irrelevant
+        self._expires: Dict[str, float] = {}
+        self._last_sync = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _store(self) -> CounterStore:
+        if self.store is not None:
+            return self.store
+        return self._local if database.db is None else MONGO_STORE
+
+    def _count(self, key: str) -> int:
+        return self._synced.get(key, 0) + self._pending.get(key, 0)
+
+    def hit(self, key: str, limit: int, window: int) -> Optional[int]:
+        """Count one request; returns None if allowed, else seconds to wait."""
+        now = time.time()
+        index = int(now // window)
+        current, previous = f"{key}|{index}", f"{key}|{index - 1}"
+        into_window = now - index * window
+
+        overlap = 1 - into_window / window
+        used = self._count(previous) * overlap + self._count(current)
+        if used + 1 > limit:
+            return max(1, math.ceil(window - into_window))
+
+        self._pending[current] = self._pending.get(current, 0) + 1
+        self._expires[current] = (index + 2) * window
+        self._expires.setdefault(previous, (index + 1) * window)
+        return None
+
+    def sync_due(self) -> bool:
+        return time.monotonic() - self._last_sync >= RATE_LIMIT_SYNC_SECONDS
+
+    async def sync(self):
+        if self._lock.locked():
+            return
+        async with self._lock:
+            self._last_sync = time.monotonic()
+            now = time.time()
+            self._expires = {k: t for k, t in self._expires.items() if t > now}
+            increments, self._pending = self._pending, {}
+            try:
+                totals = await self._store().sync(increments, dict(self._expires))
+            except PyMongoError as e:
+                # Keep counting locally; the hits go out with the next sync
+                print(f"Rate limit sync failed: {e}")
+                for key, count in increments.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+                return
+            self._synced = {k: totals.get(k, 0) for k in self._expires}
+            # Hits made while the round trip was in flight stay pending
+
+    def stats(self) -> dict:
+        return {
+            "windows": len(self._expires),
+            "pending": sum(self._pending.values()),
+        }
+
+
+MONGO_STORE = MongoCounterStore()
+limiter = SlidingWindowLimiter()
+
+
+def budget_for(method: str, path: str) -> str:
+    if (method, path) in AUTH_ROUTES:
+        return "auth"
+    if (method, path) in EXPENSIVE_ROUTES:
+        return "expensive"
+    return "read" if method in READ_METHODS else "write"
+
+
+def route_template(request: Request) -> Optional[str]:
+    """Path template of the matched route, e.g. /api/groups/{group_id}/export.
+
+    Built only from the route, never the request path. Every path a
+    ``{...:path}`` route (the SPA catch-all) serves maps to CATCH_ALL_ROUTE,
+    so probing new paths can't mint new keys or labels. None before routing
+    or when nothing matched.
+    """
+    template = getattr(request.scope.get("route"), "path", None)
+    if template is None:
+        return None
+    if ":path}" in template:
+        return CATCH_ALL_ROUTE
+    # FastAPI copies included routes with the prefix in their path; newer
+    # releases keep them on the included router and record its prefix instead
+    included = request.scope.get("fastapi", {}).get("included_router")
+    prefix = getattr(getattr(included, "include_context", None), "prefix", "")
+    return prefix + template
+
+
+def caller_identity(request: Request) -> str:
+    authorization = request.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        # jose and utils (bcrypt) stay out of the cold start until a token shows up
+        from jose import JWTError, jwt
+        from utils import ALGORITHM, SECRET_KEY
+
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("uid") or payload.get("sub"):
+                return "user:" + (payload.get("uid") or payload["sub"])
+        except JWTError:
+            pass
+
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+# Keeps background syncs referenced until they finish
+_sync_tasks: set = set()
+
+
+def _background_sync():
+    # Not charged to the request that happened to trigger it
+    task = contextvars.Context().run(asyncio.create_task, limiter.sync())
+    _sync_tasks.add(task)
+    task.add_done_callback(_sync_tasks.discard)
+
+
+async def rate_limit(request: Request):
+    """App-wide dependency: runs after routing, so the route template is known."""
+    path = route_template(request) or CATCH_ALL_ROUTE
+    if path in EXEMPT_ROUTES:
+        return
+
+    method = request.method
+    budget = budget_for(method, path)
+    limit, window = RATE_LIMITS[budget]
+    key = f"{budget}:{caller_identity(request)}:{method} {path}"
+
+    if limiter.sync_due():
+        _background_sync()
+
+    retry_after = limiter.hit(key, limit, window)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
@@ -0,0 +1,92 @@
+"""Fast path for large list responses.
+
+Normally a list endpoint builds a Pydantic model per document, and FastAPI
+validates every item again against ``response_model`` before JSON-encoding it.
+For documents we wrote ourselves that is wasted work. With
+``FAST_SERIALIZATION=1`` those endpoints instead shape the raw documents into
+the response model's keys in one pass and encode them with orjson.
+The route keeps its ``response_model``, so the OpenAPI schema is unchanged.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Type
+from datetime import datetime
+import json
+import os
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # stdlib fallback keeps the fast path usable without it
+    orjson = None
+
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "0") == "1"
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RowShaper:
+    """Turns stored documents into the JSON shape of ``model`` without
+    validating them: keys are the model's aliases (as FastAPI emits them),
+    missing fields take the model defaults and unknown keys are dropped."""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.keys: List[str] = []
+        self.defaults: Dict[str, Any] = {}
+        self.factories: Dict[str, Any] = {}
+        for name, field in model.model_fields.items():
+            key = field.alias or name
+            self.keys.append(key)
+            if field.default_factory is not None:
+                self.factories[key] = field.default_factory
+            elif not field.is_required():
+                self.defaults[key] = field.default
+
+    def row(self, doc: dict) -> dict:
+        out = {}
+        for key in self.keys:
+            if key in doc:
+                value = doc[key]
+                out[key] = str(value) if type(value) is ObjectId else value
+            elif key in self.factories:
+                out[key] = self.factories[key]()
+            elif key in self.defaults:
+                out[key] = self.defaults[key]
+        return out
+
+    def rows(self, docs: Iterable[dict]) -> List[dict]:
+        return [self.row(doc) for doc in docs]
+
+
+def partial_rows(docs: Iterable[dict]) -> List[dict]:
+    """Projected documents: only what was asked for, with ``_id`` as a string."""
+    rows = []
+    for doc in docs:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+        rows.append(doc)
+    return rows
+
+
+def fast_response(
+    content: Any, headers: Optional[Dict[str, str]] = None
+) -> FastJSONResponse:
+    return FastJSONResponse(content=content, headers=headers)
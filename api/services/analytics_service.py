@@ -0,0 +1,216 @@
+"""Per-group spend analytics for ``GET /api/groups/{id}/analytics``.
+
+One ``$facet`` aggregation over the group's expenses in a date range returns
+totals and spend by category, tag, payer, member share and calendar bucket
+(``$dateTrunc``, so MongoDB 5.0+). The ``group_date`` index serves the match.
+
+Results are cached in-process by group version, so repeat reads cost a dict
+lookup until the next expense write bumps the version.
+"""
+
+from typing import Dict, Optional
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import os
+import re
+import database
+from money import to_major
+from services.expense_service import group_query
+
+INTERVALS = {"day", "week", "month"}
+
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "256"))
+
+# $dateTrunc also takes UTC offsets: +hh, +hhmm or +hh:mm
+UTC_OFFSET = re.compile(r"[+-]\d{2}(:?\d{2})?")
+
+
+def valid_timezone(timezone: str) -> bool:
+    """Whether $dateTrunc accepts ``timezone``: an Olson name or a UTC offset."""
+    if UTC_OFFSET.fullmatch(timezone):
+        return True
+    try:
+        ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def build_pipeline(
+    group_id: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    interval: str,
+    timezone: str,
+) -> list:
+    def spend_by(key) -> list:
+        return [
+            {
+                "$group": {
+                    "_id": key,
+                    "amount": {"$sum": "$amount_minor"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$sort": {"amount": -1, "_id": 1}},
+        ]
+
+    return [
+        {"$match": group_query(group_id, start, end)},
+        {
+            "$project": {
+                "amount_minor": 1,
+                "category": 1,
+                "tags": 1,
+                "payer_id": 1,
+                "split_minor": 1,
+                "date": 1,
+            }
+        },
+        {
+            "$facet": {
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "amount": {"$sum": "$amount_minor"},
+                            "count": {"$sum": 1},
+                            "first": {"$min": "$date"},
+                            "last": {"$max": "$date"},
+                        }
+                    }
+                ],
+                "categories": spend_by("$category"),
+                "tags": [{"$unwind": "$tags"}] + spend_by("$tags"),
+                "paid": spend_by("$payer_id"),
+                "shares": [
+                    {"$project": {"split": {"$objectToArray": "$split_minor"}}},
+                    {"$unwind": "$split"},
+                    {
+                        "$group": {
+                            "_id": "$split.k",
+                            "amount": {"$sum": "$split.v"},
+                            "count": {"$sum": 1},
+                        }
+                    },
+                ],
+                "series": [
+                    {
+                        "$group": {
+                            "_id": {
+                                "$dateTrunc": {
+                                    "date": "$date",
+                                    "unit": interval,
+                                    "timezone": timezone,
+                                    "startOfWeek": "monday",
+                                }
+                            },
+                            "amount": {"$sum": "$amount_minor"},
+                            "count": {"$sum": 1},
+                        }
+                    },
+                    {"$sort": {"_id": 1}},
+                ],
+            }
+        },
+    ]
+
+
+def _rows(buckets: list, key: str) -> list:
+    return [
+        {key: b["_id"], "amount": to_major(b["amount"]), "count": b["count"]}
+        for b in buckets
+    ]
+
+
+def shape_result(facets: dict) -> dict:
+    totals = facets["totals"][0] if facets["totals"] else None
+
+    members: Dict[str, dict] = {}
+    for field, rows in (("paid", facets["paid"]), ("share", facets["shares"])):
+        for row in rows:
+            member = members.setdefault(row["_id"], {"paid": 0, "share": 0})
+            member[field] = row["amount"]
+
+    return {
+        "total": to_major(totals["amount"]) if totals else 0.0,
+        "expense_count": totals["count"] if totals else 0,
+        "first_date": totals["first"] if totals else None,
+        "last_date": totals["last"] if totals else None,
+        "by_category": _rows(facets["categories"], "category"),
+        "by_tag": _rows(facets["tags"], "tag"),
+        "by_member": sorted(
+            (
+                {
+                    "user_id": uid,
+                    "paid": to_major(m["paid"]),
+                    "share": to_major(m["share"]),
+                    "net": to_major(m["paid"] - m["share"]),
+                }
+                for uid, m in members.items()
+            ),
+            key=lambda m: (-m["share"], m["user_id"]),
+        ),
+        "series": _rows(facets["series"], "period"),
+    }
+
+
+class AnalyticsCache:
+    """Results keyed by (group, version, query); a write bumps the version,
+    so stale entries are never hit and just age out of the LRU."""
+
+    def __init__(self, maxsize: int = ANALYTICS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[dict]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value: dict):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+analytics_cache = AnalyticsCache()
+
+
+async def group_analytics(
+    group_id: str,
+    version: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "month",
+    timezone: str = "UTC",
+) -> dict:
+    key = (group_id, version, start, end, interval, timezone)
+    cached = analytics_cache.get(key)
+    if cached is not None:
+        return cached
+
+    pipeline = build_pipeline(group_id, start, end, interval, timezone)
+    # $facet always emits exactly one document
+    facets = (await database.db.expenses.aggregate(pipeline).to_list(1))[0]
+    result = {
+        "group_id": group_id,
+        "start": start,
+        "end": end,
+        "interval": interval,
+        "timezone": timezone,
+        **shape_result(facets),
+    }
+    analytics_cache.set(key, result)
+    return result
@@ -1,33 +1,72 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
+import heapq
+from money import expense_minor, to_major
 
+# (debtor, creditor, amount in minor units)
+Transfer = Tuple[str, str, int]
 
-def calculate_settlements(expenses: List[dict]) -> List[dict]:
-    balances: Dict[str, float] = {}
+# The exact solver is exponential in the number of non-zero balances
+OPTIMAL_MAX_MEMBERS = 12
+
+
+def compute_net_balances(expenses: List[dict]) -> Dict[str, int]:
+    balances: Dict[str, int] = {}
 
     for expense in expenses:
-        # Normalize ObjectId vs str
-        payer = str(expense["payer_id"])
-        amount = float(expense["amount"])
-        splits = expense.get("split_details", {})
+        for uid, delta in expense_deltas(expense).items():
+            balances[uid] = balances.get(uid, 0) + delta
+
+    return balances
+
+
+def expense_deltas(expense: dict) -> Dict[str, int]:
+    """Net balance change (minor units) a single expense applies to each member."""
+    deltas: Dict[str, int] = {}
+
+    # Normalize ObjectId vs str
+    payer = str(expense["payer_id"])
+    amount, splits = expense_minor(expense)
+
+    deltas[payer] = deltas.get(payer, 0) + amount
+
+    for uid, share in splits.items():
+        uid_str = str(uid)
+        deltas[uid_str] = deltas.get(uid_str, 0) - share
+
+    return deltas
 
-        balances[payer] = balances.get(payer, 0.0) + amount
 
-        for uid, share in splits.items():
-            uid_str = str(uid)
-            balances[uid_str] = balances.get(uid_str, 0.0) - float(share)
+def calculate_settlements(expenses: List[dict]) -> List[dict]:
+    return settle_balances(compute_net_balances(expenses))
+
+
+def settle_balances(balances: Dict[str, int], mode: str = "auto") -> List[dict]:
+    """Settle net balances given in minor units; amounts come back in major units."""
+    if mode not in SETTLEMENT_MODES:
+        raise ValueError(f"Unknown settlement mode: {mode}")
+
+    minor = {uid: bal for uid, bal in balances.items() if bal != 0}
+
+    if mode == "auto":
+        mode = "optimal" if len(minor) <= OPTIMAL_MAX_MEMBERS else "heap"
 
-    # Simplify debts (greedy approach)
-    debtors = []
-    creditors = []
+    transfers = SETTLEMENT_MODES[mode](minor)
+    return [
+        {"from": debtor, "to": creditor, "amount": to_major(amount)}
+        for debtor, creditor, amount in transfers
+    ]
 
-    for uid, bal in balances.items():
-        if bal < -0.01:
-            debtors.append({"id": uid, "amount": bal})
-        elif bal > 0.01:
-            creditors.append({"id": uid, "amount": bal})
 
-    debtors.sort(key=lambda x: x["amount"])
-    creditors.sort(key=lambda x: x["amount"], reverse=True)
+def settle_greedy(balances: Dict[str, int]) -> List[Transfer]:
+    """Single pass pairing the largest debtors with the largest creditors."""
+    debtors = sorted(
+        ([uid, bal] for uid, bal in balances.items() if bal < 0), key=lambda x: x[1]
+    )
+    creditors = sorted(
+        ([uid, bal] for uid, bal in balances.items() if bal > 0),
+        key=lambda x: x[1],
+        reverse=True,
+    )
 
     settlements = []
 
@@ -38,18 +77,106 @@ def calculate_settlements(expenses: List[dict]) -> List[dict]:
         debtor = debtors[d_idx]
         creditor = creditors[c_idx]
 
-        amount = min(abs(debtor["amount"]), creditor["amount"])
+        amount = min(-debtor[1], creditor[1])
+        settlements.append((debtor[0], creditor[0], amount))
 
-        settlements.append(
-            {"from": debtor["id"], "to": creditor["id"], "amount": round(amount, 2)}
-        )
-
-        debtor["amount"] += amount
-        creditor["amount"] -= amount
+        debtor[1] += amount
+        creditor[1] -= amount
 
-        if abs(debtor["amount"]) < 0.01:
+        if debtor[1] == 0:
             d_idx += 1
-        if creditor["amount"] < 0.01:
+        if creditor[1] == 0:
             c_idx += 1
 
     return settlements
+
+
+def settle_heap(balances: Dict[str, int]) -> List[Transfer]:
+    """O(n log n): repeatedly match the current largest debt with the largest credit.
+
+    Remainders go back on their heap, so each step fully settles at least one
+    member and the result has at most n - 1 transfers.
+    """
+    debtors = [(bal, uid) for uid, bal in balances.items() if bal < 0]
+    creditors = [(-bal, uid) for uid, bal in balances.items() if bal > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    settlements = []
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+
+        amount = min(-debt, -credit)
+        settlements.append((debtor, creditor, amount))
+
+        if debt + amount < 0:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if credit + amount < 0:
+            heapq.heappush(creditors, (credit + amount, creditor))
+
+    return settlements
+
+
+def settle_optimal(balances: Dict[str, int]) -> List[Transfer]:
+    """Minimum number of transfers.
+
+    A zero-sum cluster of k members settles in k - 1 transfers, so the
+    minimum is n minus the largest number of disjoint zero-sum clusters.
+    That partition is found with a DP over subsets (O(2^n * n)), which is
+    only viable for small groups; see OPTIMAL_MAX_MEMBERS.
+    """
+    members = list(balances.items())
+    n = len(members)
+    if n > OPTIMAL_MAX_MEMBERS:
+        raise ValueError(
+            f"Optimal settlement supports at most {OPTIMAL_MAX_MEMBERS} members"
+        )
+
+    full = (1 << n) - 1
+    sums = [0] * (full + 1)
+    clusters = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + members[low.bit_length() - 1][1]
+        closes = 1 if sums[mask] == 0 else 0
+        clusters[mask] = closes + max(
+            clusters[mask ^ (1 << i)] for i in range(n) if mask >> i & 1
+        )
+
+    # Walk back through the DP to recover an ordering whose zero prefix sums
+    # mark cluster boundaries
+    order = []
+    mask = full
+    while mask:
+        closes = 1 if sums[mask] == 0 else 0
+        for i in range(n):
+            if mask >> i & 1 and clusters[mask ^ (1 << i)] + closes == clusters[mask]:
+                order.append(i)
+                mask ^= 1 << i
+                break
+    order.reverse()
+
+    settlements = []
+    cluster = {}
+    running = 0
+    for i in order:
+        uid, bal = members[i]
+        cluster[uid] = bal
+        running += bal
+        if running == 0:
+            settlements.extend(settle_greedy(cluster))
+            cluster = {}
+    if cluster:
+        # Rounding residue: the remaining members don't sum to zero
+        settlements.extend(settle_greedy(cluster))
+
+    return settlements
+
+
+SETTLEMENT_MODES = {
+    "auto": None,
+    "greedy": settle_greedy,
+    "optimal": settle_optimal,
+    "heap": settle_heap,
+}
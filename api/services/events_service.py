@@ -0,0 +1,242 @@
+"""Live group events for ``GET /api/groups/{id}/events``.
+
+A single hub per process fans events out to every open stream of a group.
+Where the deployment supports change streams (replica sets), one shared
+watcher on the database turns expense and ledger writes from *any* API
+instance into events. On a standalone server the watcher can't open, and the
+expense handlers publish to the hub directly instead.
+
+Each stream has its own bounded queue. A consumer that falls behind loses its
+backlog and receives a ``resync`` event telling it to refetch.
+"""
+
+from typing import Dict, List, Optional, Set
+import asyncio
+import contextvars
+import json
+import os
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import OperationFailure, PyMongoError
+import database
+from models import ExpenseInDB
+from money import expense_to_api
+from services import ledger_service
+from services.balance_service import settle_balances
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+
+# Comment lines sent on idle streams so proxies don't close them
+HEARTBEAT_SECONDS = 15
+
+# Wait before reopening a change stream that failed after it was running
+WATCH_RETRY_SECONDS = 5
+
+EXPENSE_EVENTS = {
+    "insert": "expense_created",
+    "update": "expense_updated",
+    "replace": "expense_updated",
+}
+# Ledger writes: balances, group deletion and (via last_deleted) expense deletes
+LEDGER_EVENTS = ["insert", "update", "replace", "delete"]
+
+
+def expense_event(kind: str, expense: dict) -> dict:
+    if kind == "expense_deleted":
+        return {"type": kind, "id": str(expense["_id"])}
+    api = ExpenseInDB(**expense_to_api(dict(expense)))
+    return {"type": kind, "expense": jsonable_encoder(api)}
+
+
+def balances_event(balances: Dict[str, int]) -> dict:
+    return {"type": "balances", "settlements": settle_balances(balances)}
+
+
+def format_event(event: dict) -> str:
+    """Serialize an event as one Server-Sent Events message."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class GroupEventHub:
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        # True while the change stream is open and is the source of events
+        self.change_streams = False
+        # Set once the server has refused a change stream; never retried
+        self._unsupported = False
+        # Keeps balance replays referenced until they finish
+        self._replays: Set[asyncio.Task] = set()
+
+    def subscribe(self, group_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(group_id, set()).add(queue)
+        self._ensure_watcher()
+        return queue
+
+    def unsubscribe(self, group_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(group_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[group_id]
+
+    def has_subscribers(self, group_id: str) -> bool:
+        return group_id in self._subscribers
+
+    def stats(self) -> dict:
+        return {
+            "groups": len(self._subscribers),
+            "streams": sum(len(q) for q in self._subscribers.values()),
+            "change_streams": self.change_streams,
+        }
+
+    def deliver(self, group_id: str, events: List[dict]):
+        for queue in self._subscribers.get(group_id, ()):
+            for event in events:
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Slow consumer: drop its backlog, it has to refetch anyway
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait({"type": "resync"})
+                    break
+
+    async def publish(self, group_id: str, events: List[dict]):
+        """Events from the request handlers, followed by fresh balances.
+
+        Skipped while the change stream is running; it already sees the same
+        writes, from every instance.
+        """
+        if self.change_streams or not self.has_subscribers(group_id):
+            return
+        balances = await ledger_service.get_group_net_balances(group_id)
+        self.deliver(group_id, events + [balances_event(balances)])
+
+    def _ensure_watcher(self):
+        if self._unsupported or database.db is None:
+            return
+        if self._watcher is None or self._watcher.done():
+            # Started from a stream request; an empty context keeps the
+            # watcher (and the replays it spawns) out of that request's metrics
+            self._watcher = contextvars.Context().run(
+                asyncio.create_task, self._watch()
+            )
+
+    async def _watch(self):
+        # Expense deletes carry no group_id without pre-images (MongoDB 6.0+
+        # and enabled per collection), so they come from the ledger instead
+        pipeline = [
+            {
+                "$match": {
+                    "$or": [
+                        {
+                            "ns.coll": "expenses",
+                            "operationType": {"$in": list(EXPENSE_EVENTS)},
+                        },
+                        {
+                            "ns.coll": ledger_service.LEDGER_COLLECTION,
+                            "operationType": {"$in": LEDGER_EVENTS},
+                        },
+                    ]
+                }
+            }
+        ]
+        resume_token = None
+        while True:
+            try:
+                async with database.db.watch(
+                    pipeline,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                ) as stream:
+                    self.change_streams = True
+                    print("Group events: watching change streams")
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._on_change(change)
+            except OperationFailure as e:
+                self.change_streams = False
+                if resume_token is None:
+                    # Standalone servers refuse $changeStream outright
+                    self._unsupported = True
+                    print(f"Group events: change streams unavailable ({e})")
+                    return
+                print(f"Group events: change stream failed, retrying: {e}")
+            except PyMongoError as e:
+                self.change_streams = False
+                print(f"Group events: change stream failed, retrying: {e}")
+            await asyncio.sleep(WATCH_RETRY_SECONDS)
+
+    def _on_change(self, change: dict):
+        operation = change["operationType"]
+        if change["ns"]["coll"] == ledger_service.LEDGER_COLLECTION:
+            group_id = change["documentKey"]["_id"]
+            if not self.has_subscribers(group_id):
+                return
+            if operation == "delete":
+                self.deliver(group_id, [{"type": "group_deleted"}])
+                return
+
+            ledger = change.get("fullDocument") or {}
+            # updateLookup returns the latest document, which may still hold an
+            # earlier delete; only this write's own fields say what it did
+            if operation == "update":
+                written = change.get("updateDescription", {}).get("updatedFields", {})
+            else:
+                written = ledger
+            deleted = written.get("last_deleted")
+            events = [{"type": "expense_deleted", "id": deleted}] if deleted else []
+
+            if ledger.get("rebuilt"):
+                balances = ledger.get("balances", {})
+                self.deliver(group_id, events + [balances_event(balances)])
+            else:
+                # A ledger that isn't rebuilt holds no balances; replay them
+                self.deliver(group_id, events)
+                task = asyncio.create_task(self._deliver_balances(group_id))
+                self._replays.add(task)
+                task.add_done_callback(self._replays.discard)
+            return
+
+        expense = change.get("fullDocument")
+        if expense is None or not self.has_subscribers(expense["group_id"]):
+            return
+        kind = EXPENSE_EVENTS[operation]
+        self.deliver(expense["group_id"], [expense_event(kind, expense)])
+
+    async def _deliver_balances(self, group_id: str):
+        self.deliver(group_id, [await current_balances(group_id)])
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        self.change_streams = False
+
+
+hub = GroupEventHub()
+
+
+async def expense_changed(kind: str, expense: dict):
+    await hub.publish(str(expense["group_id"]), [expense_event(kind, expense)])
+
+
+async def expenses_imported(group_id: str, count: int):
+    await hub.publish(group_id, [{"type": "expenses_imported", "count": count}])
+
+
+def group_deleted(group_id: str):
+    # No balances to follow: reading them would recreate the dropped ledger
+    if not hub.change_streams:
+        hub.deliver(group_id, [{"type": "group_deleted"}])
+
+
+async def current_balances(group_id: str) -> dict:
+    return balances_event(await ledger_service.get_group_net_balances(group_id))
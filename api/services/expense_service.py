@@ -0,0 +1,173 @@
+from typing import List, Optional
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+import database
+from money import expense_minor, rebalance_split
+
+# Expense filters and sorts shared by the query sites and by
+# indexes.check_query_plans, so the plans checked are the ones sent
+NEWEST_FIRST = [("date", -1), ("_id", -1)]
+OLDEST_FIRST = [("date", 1)]
+
+
+def group_query(
+    group_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> dict:
+    """A group's expenses, optionally within [start, end)."""
+    query: dict = {"group_id": group_id}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lt"] = end
+    return query
+
+
+def participant_query(user_id: str) -> dict:
+    return {"participants": user_id}
+
+
+def expense_participants(payer_id: str, split: dict) -> List[str]:
+    """Everyone an expense touches: the payer plus every user in the split.
+
+    Stored on the document as ``participants`` so per-user queries can use a
+    multikey index instead of ``split_details.<uid>: {$exists: true}``.
+    """
+    participants = [str(payer_id)]
+    for uid in split:
+        if str(uid) not in participants:
+            participants.append(str(uid))
+    return participants
+
+
+def with_participants(expense: dict) -> dict:
+    split = expense.get("split_minor", expense.get("split_details", {}))
+    expense["participants"] = expense_participants(expense["payer_id"], split)
+    return expense
+
+
+async def backfill_participants() -> int:
+    """Populate ``participants`` on expenses written before the field existed."""
+    result = await database.db.expenses.update_many(
+        {"participants": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "participants": {
+                        "$setUnion": [
+                            ["$payer_id"],
+                            {
+                                "$map": {
+                                    "input": {
+                                        "$objectToArray": {
+                                            "$ifNull": [
+                                                "$split_minor",
+                                                "$split_details",
+                                            ]
+                                        }
+                                    },
+                                    "in": "$$this.k",
+                                }
+                            },
+                        ]
+                    }
+                }
+            }
+        ],
+    )
+    return result.modified_count
+
+
+MIGRATION_BATCH = 1000
+
+
+async def _write_batches(cursor, convert) -> int:
+    """Apply ``convert(doc) -> update or None`` to every document, in bulk."""
+    count = 0
+    ops = []
+    async for doc in cursor:
+        update = convert(doc)
+        if update is None:
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        if len(ops) == MIGRATION_BATCH:
+            await database.db.expenses.bulk_write(ops, ordered=False)
+            count += len(ops)
+            ops = []
+    if ops:
+        await database.db.expenses.bulk_write(ops, ordered=False)
+        count += len(ops)
+    return count
+
+
+def _legacy_to_minor(doc: dict) -> dict:
+    amount_minor, split_minor = expense_minor(doc)
+    return {
+        "$set": {"amount_minor": amount_minor, "split_minor": split_minor},
+        "$unset": {"amount": "", "split_details": ""},
+    }
+
+
+def _rebalanced(doc: dict) -> Optional[dict]:
+    split = doc.get("split_minor", {})
+    fixed = rebalance_split(doc["amount_minor"], split)
+    return {"$set": {"split_minor": fixed}} if fixed != split else None
+
+
+async def migrate_money() -> int:
+    """Convert float amount/split_details to integer amount_minor/split_minor.
+
+    Each split is allocated as a whole (see money.split_to_minor), so equal
+    splits keep summing to the amount. Expenses converted earlier one share at
+    a time get their rounding residue spread back over the split. Ledgers and
+    stats rollups must be rebuilt afterwards.
+    """
+    legacy = database.db.expenses.find(
+        {"amount_minor": {"$exists": False}},
+        {"amount": 1, "split_details": 1},
+    )
+    count = await _write_batches(legacy, _legacy_to_minor)
+
+    split_total = {
+        "$sum": {
+            "$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$split_minor", {}]}},
+                "in": "$$this.v",
+            }
+        }
+    }
+    residue = database.db.expenses.find(
+        {
+            "amount_minor": {"$exists": True},
+            "$expr": {"$ne": ["$amount_minor", split_total]},
+        },
+        {"amount_minor": 1, "split_minor": 1},
+    )
+    return count + await _write_batches(residue, _rebalanced)
+
+
+async def migrate_group_expense_counts() -> int:
+    """Replace the unbounded groups.expenses id arrays with expense_count."""
+    counts = await database.db.expenses.aggregate(
+        [{"$group": {"_id": "$group_id", "count": {"$sum": 1}}}]
+    ).to_list(length=None)
+
+    ops = [
+        UpdateOne(
+            {"_id": ObjectId(row["_id"])},
+            {"$set": {"expense_count": row["count"]}, "$unset": {"expenses": ""}},
+        )
+        for row in counts
+        if ObjectId.is_valid(row["_id"])
+    ]
+    if ops:
+        await database.db.groups.bulk_write(ops, ordered=False)
+
+    # Groups without any expenses
+    await database.db.groups.update_many(
+        {"expense_count": {"$exists": False}},
+        {"$set": {"expense_count": 0}, "$unset": {"expenses": ""}},
+    )
+    return len(ops)
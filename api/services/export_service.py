@@ -0,0 +1,105 @@
+from typing import AsyncIterator, List, Optional
+from datetime import datetime
+import csv
+import io
+import json
+import zlib
+import database
+from money import expense_to_api
+from services import user_service
+from services.expense_service import OLDEST_FIRST, group_query
+
+BATCH_SIZE = 500
+
+CSV_HEADER = ["Date", "Description", "Category", "Amount", "Payer", "Splits"]
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+
+def build_query(
+    group_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> dict:
+    return group_query(group_id, start, end)
+
+
+async def _batches(query: dict) -> AsyncIterator[List[dict]]:
+    cursor = database.db.expenses.find(query).sort(OLDEST_FIRST).batch_size(BATCH_SIZE)
+    while True:
+        batch = await cursor.to_list(length=BATCH_SIZE)
+        if not batch:
+            return
+        yield batch
+
+
+def _csv_rows(batch: List[dict], payer_names: dict) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for exp in batch:
+        # Format splits
+        splits_str = ", ".join(
+            [f"{uid}:{amt}" for uid, amt in exp["split_details"].items()]
+        )
+        writer.writerow(
+            [
+                exp.get("date", ""),
+                exp["description"],
+                exp.get("category", "General"),
+                exp["amount"],
+                payer_names[exp["payer_id"]],
+                splits_str,
+            ]
+        )
+    return output.getvalue()
+
+
+def _ndjson_rows(batch: List[dict], payer_names: dict) -> str:
+    lines = []
+    for exp in batch:
+        date = exp.get("date")
+        lines.append(
+            json.dumps(
+                {
+                    "id": str(exp["_id"]),
+                    "date": date.isoformat() if date else None,
+                    "description": exp["description"],
+                    "category": exp.get("category", "General"),
+                    "tags": exp.get("tags", []),
+                    "amount": exp["amount"],
+                    "payer_id": exp["payer_id"],
+                    "payer": payer_names[exp["payer_id"]],
+                    "split_details": exp["split_details"],
+                }
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+async def stream_expenses(query: dict, fmt: str = "csv") -> AsyncIterator[str]:
+    """Yield the export one cursor batch at a time.
+
+    Payer names are resolved per batch with a single query, so memory stays
+    bounded by BATCH_SIZE regardless of how many expenses the group has.
+    """
+    if fmt == "csv":
+        header = io.StringIO()
+        csv.writer(header).writerow(CSV_HEADER)
+        yield header.getvalue()
+
+    render = _csv_rows if fmt == "csv" else _ndjson_rows
+    async for batch in _batches(query):
+        batch = [expense_to_api(e) for e in batch]
+        payer_names = await user_service.resolve_names(e["payer_id"] for e in batch)
+        yield render(batch, payer_names)
+
+
+async def gzip_stream(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    # wbits=31 produces a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,271 @@
+"""Content-addressed image storage for avatars and group icons.
+
+An upload is streamed to a temporary file while it is hashed, then renamed to
+``<sha256>.<ext>`` in UPLOAD_DIR, so identical uploads share one file. Resized
+variants (``<sha256>.thumb.webp`` and ``<sha256>.display.webp``) are written
+next to it by a small worker pool. The format is sniffed from the file's
+leading bytes; the client's ``content_type`` is never trusted.
+
+Each stored image has an ``uploads`` document counting the avatars and icons
+that point at it. ``retain`` and ``release`` keep that count; files go once
+it drops to zero. Uploads nothing ever references are removed by
+``manage.py uploads prune``.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from pymongo import ReturnDocument
+import database
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without Pillow, originals are stored and served as-is
+    Image = None
+
+UPLOADS_COLLECTION = "uploads"
+
+UPLOAD_DIR = Path(__file__).resolve().parent.parent / "uploads"
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Decoding a small file can still allocate a huge bitmap
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# name -> longest edge in pixels. Avatars render at up to 80px, so thumbnails
+# cover every list view at 1.5x density.
+VARIANTS = {"thumb": 128, "display": 1024}
+VARIANT_FORMAT = "webp"
+
+# Leading bytes -> stored extension
+SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+# <sha256>.<ext> originals; anything else under /uploads/ predates hashing
+STORED_NAME = re.compile(r"^([0-9a-f]{64})\.(png|jpg|gif|webp)$")
+
+# Files the variants of one image are written to, removed together with it
+VARIANT_SUFFIXES = [f".{name}.{VARIANT_FORMAT}" for name in VARIANTS]
+
+# ORPHAN_GRACE covers the gap between an upload and the profile or group
+# update that attaches it.
+ORPHAN_GRACE = timedelta(hours=24)
+
+_image_executor = ThreadPoolExecutor(
+    max_workers=IMAGE_WORKERS, thread_name_prefix="images"
+)
+
+
+class UploadTooLarge(Exception):
+    """The body went past MAX_UPLOAD_BYTES."""
+
+
+class UnsupportedImage(Exception):
+    """The bytes are not a PNG, JPEG, GIF or WebP image we can decode."""
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def stored_name(url: Optional[str]) -> Optional[Tuple[str, str]]:
+    """``/uploads/<sha256>.<ext>`` -> (sha256, ext); None for anything else."""
+    if not url or "/uploads/" not in url:
+        return None
+    match = STORED_NAME.match(url.split("/uploads/")[-1])
+    return (match.group(1), match.group(2)) if match else None
+
+
+def image_urls(digest: str, ext: str, variants: List[str]) -> Dict[str, str]:
+    url = f"/uploads/{digest}.{ext}"
+    urls = {"url": url}
+    for name in VARIANTS:
+        # Without a variant (no Pillow) clients fall back to the original
+        urls[f"{name}_url"] = (
+            f"/uploads/{digest}.{name}.{VARIANT_FORMAT}" if name in variants else url
+        )
+    return urls
+
+
+def _run(func, *args):
+    return asyncio.get_running_loop().run_in_executor(_image_executor, func, *args)
+
+
+def _write_chunk(handle, chunk: bytes):
+    handle.write(chunk)
+
+
+def _commit_file(tmp_path: Path, final_path: Path):
+    # A duplicate already on disk has the same bytes, so keep it
+    if final_path.exists():
+        tmp_path.unlink()
+    else:
+        os.replace(tmp_path, final_path)
+
+
+def _discard(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _make_variants(path: Path, digest: str) -> List[str]:
+    """Decode the original and write every missing variant. Runs in a worker."""
+    if Image is None:
+        return []
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    made = []
+    try:
+        with Image.open(path) as image:
+            image.load()
+            # Phone photos carry their rotation in EXIF; bake it in
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            for name, edge in VARIANTS.items():
+                target = UPLOAD_DIR / f"{digest}.{name}.{VARIANT_FORMAT}"
+                if not target.exists():
+                    variant = image.copy()
+                    variant.thumbnail((edge, edge), Image.LANCZOS)
+                    tmp = target.with_name(f".{uuid.uuid4().hex}.tmp")
+                    variant.save(tmp, format=VARIANT_FORMAT.upper(), quality=82)
+                    os.replace(tmp, target)
+                made.append(name)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise UnsupportedImage(str(e))
+    return made
+
+
+async def store_upload(file) -> Dict[str, str]:
+    """Stream an UploadFile to content-addressed storage and return its URLs.
+
+    Raises UploadTooLarge or UnsupportedImage; nothing is left on disk then.
+    """
+    tmp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    try:
+        handle = await _run(open, tmp_path, "wb")
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = sniff_format(chunk)
+                    if ext is None:
+                        raise UnsupportedImage("Unrecognised image format")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                await _run(_write_chunk, handle, chunk)
+        finally:
+            await _run(handle.close)
+        if ext is None:
+            raise UnsupportedImage("Empty file")
+
+        hexdigest = digest.hexdigest()
+        final_path = UPLOAD_DIR / f"{hexdigest}.{ext}"
+        await _run(_commit_file, tmp_path, final_path)
+    except BaseException:
+        await _run(_discard, tmp_path)
+        raise
+
+    try:
+        variants = await _run(_make_variants, final_path, hexdigest)
+    except UnsupportedImage:
+        record = await database.db[UPLOADS_COLLECTION].find_one(
+            {"_id": hexdigest}, {"_id": 1}
+        )
+        if record is None:
+            await _run(_remove_files, hexdigest, ext)
+        raise
+
+    await database.db[UPLOADS_COLLECTION].update_one(
+        {"_id": hexdigest},
+        {
+            "$setOnInsert": {
+                "ext": ext,
+                "size": size,
+                "refs": 0,
+                "created_at": datetime.utcnow(),
+            },
+            "$set": {"variants": variants},
+        },
+        upsert=True,
+    )
+    return image_urls(hexdigest, ext, variants)
+
+
+def _remove_files(digest: str, ext: str):
+    for suffix in [f".{ext}"] + VARIANT_SUFFIXES:
+        _discard(UPLOAD_DIR / f"{digest}{suffix}")
+
+
+async def retain(url: Optional[str]):
+    """Count a new reference (avatar or group icon) to a stored image."""
+    name = stored_name(url)
+    if name is None:
+        return
+    await database.db[UPLOADS_COLLECTION].update_one(
+        {"_id": name[0]}, {"$inc": {"refs": 1}}
+    )
+
+
+async def release(url: Optional[str]):
+    """Drop one reference to a stored image, deleting it with the last one."""
+    name = stored_name(url)
+    if name is None:
+        return
+    digest, ext = name
+    record = await database.db[UPLOADS_COLLECTION].find_one_and_update(
+        {"_id": digest},
+        {"$inc": {"refs": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if record is None or record["refs"] > 0:
+        return
+    # The refs filter loses to a retain that got in after our decrement
+    deleted = await database.db[UPLOADS_COLLECTION].delete_one(
+        {"_id": digest, "refs": {"$lte": 0}}
+    )
+    if deleted.deleted_count:
+        await _run(_remove_files, digest, ext)
+
+
+async def prune_orphans() -> int:
+    """Delete uploads that were never attached to anything. Returns the count."""
+    cutoff = datetime.utcnow() - ORPHAN_GRACE
+    count = 0
+    cursor = database.db[UPLOADS_COLLECTION].find(
+        {"refs": {"$lte": 0}, "created_at": {"$lt": cutoff}}, {"ext": 1}
+    )
+    async for record in cursor:
+        deleted = await database.db[UPLOADS_COLLECTION].delete_one(
+            {"_id": record["_id"], "refs": {"$lte": 0}}
+        )
+        if deleted.deleted_count:
+            await _run(_remove_files, record["_id"], record["ext"])
+            count += 1
+    return count
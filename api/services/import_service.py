@@ -0,0 +1,139 @@
+from typing import Dict, List, Tuple
+from datetime import datetime
+import csv
+import io
+from bson import ObjectId
+from pydantic import ValidationError
+import database
+from models import ExpenseCreate
+from money import SplitMismatch, expense_to_db
+from services import events_service, ledger_service, rollup_service, user_service
+from services.expense_service import with_participants
+from services.export_service import CSV_HEADER
+
+# Largest batch accepted by one import request
+MAX_IMPORT_ROWS = 20000
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+    )
+
+
+def parse_csv(text: str, members: Dict[str, str]) -> Tuple[List[dict], List[dict]]:
+    """Parse the export CSV back into expense rows.
+
+    ``members`` maps member name -> id; the Payer column holds a name (as
+    written by the export) or a member id. Rows are numbered from 1, after
+    the header, and carry their number in ``row`` for error reporting.
+    """
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if header != CSV_HEADER:
+        return [], [{"row": 0, "error": f"Expected header {','.join(CSV_HEADER)}"}]
+
+    rows, errors = [], []
+    for number, record in enumerate(reader, start=1):
+        if not any(record):
+            continue
+        if len(record) != len(CSV_HEADER):
+            errors.append({"row": number, "error": "Wrong number of columns"})
+            continue
+        date, description, category, amount, payer, splits = record
+
+        payer_id = payer if payer in members.values() else members.get(payer)
+        if payer_id is None:
+            errors.append({"row": number, "error": f"Unknown payer: {payer}"})
+            continue
+
+        try:
+            split_details = {}
+            for part in splits.split(","):
+                if part.strip():
+                    uid, share = part.strip().split(":", 1)
+                    split_details[uid] = float(share)
+            row = {
+                "description": description,
+                "category": category or "General",
+                "amount": amount,
+                "payer_id": payer_id,
+                "split_details": split_details,
+            }
+            if date:
+                row["date"] = datetime.fromisoformat(date)
+        except ValueError:
+            errors.append({"row": number, "error": "Malformed date or splits"})
+            continue
+
+        rows.append({"row": number, **row})
+    return rows, errors
+
+
+def validate_rows(
+    group_id: str, rows: List[dict], member_ids: set
+) -> Tuple[List[dict], List[dict]]:
+    """Validate every row in one pass; returns (documents, errors)."""
+    documents, errors = [], []
+    for index, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": index, "error": "Row must be an object"})
+            continue
+        number = row.pop("row", index)
+        try:
+            expense = ExpenseCreate(**{**row, "group_id": group_id})
+        except ValidationError as e:
+            errors.append({"row": number, "error": _validation_message(e)})
+            continue
+
+        outsiders = ({expense.payer_id} | set(expense.split_details)) - member_ids
+        if outsiders:
+            errors.append(
+                {"row": number, "error": f"Not group members: {sorted(outsiders)}"}
+            )
+            continue
+
+        try:
+            documents.append(with_participants(expense_to_db(expense.dict())))
+        except SplitMismatch as e:
+            errors.append({"row": number, "error": str(e)})
+    return documents, errors
+
+
+async def member_names(member_ids: List[str]) -> Dict[str, str]:
+    """Member name -> id. Names shared by several members can't identify a
+    payer and are left out."""
+    users = await user_service.resolve_users(member_ids)
+    names: Dict[str, str] = {}
+    shared = set()
+    for uid, user in users.items():
+        if user.name in names:
+            shared.add(user.name)
+        names[user.name] = uid
+    return {name: uid for name, uid in names.items() if name not in shared}
+
+
+async def import_expenses(group_id: str, rows: List[dict], member_ids: set) -> dict:
+    documents, errors = validate_rows(group_id, rows, member_ids)
+
+    inserted_ids = []
+    if documents:
+        result = await database.db.expenses.insert_many(documents, ordered=False)
+        inserted_ids = [str(i) for i in result.inserted_ids]
+
+        # Derived data is updated from the local documents, one round trip each
+        await ledger_service.record_expenses(group_id, documents)
+        await rollup_service.record_expenses(documents)
+
+        # Bumped last, so the new ETag is never served with the old balances
+        await database.db.groups.update_one(
+            {"_id": ObjectId(group_id)},
+            {"$inc": {"expense_count": len(inserted_ids), "version": 1}},
+        )
+        await events_service.expenses_imported(group_id, len(inserted_ids))
+
+    return {
+        "inserted": len(inserted_ids),
+        "ids": inserted_ids,
+        "errors": sorted(errors, key=lambda e: e["row"]),
+    }
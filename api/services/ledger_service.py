@@ -0,0 +1,210 @@
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+import database
+from services.balance_service import expense_deltas
+from services.expense_service import group_query
+
+# One document per group: {_id: group_id, balances: {user_id: net}, rebuilt,
+# version}, in minor units. Positive = the member is owed money, negative =
+# the member owes.
+#
+# Deltas only apply to ledgers marked ``rebuilt``, i.e. holding the group's
+# whole history; they are never upserted into a partial ledger. Groups from
+# before the ledger are replayed on every read until `manage.py ledger
+# rebuild` folds their history in. Every write bumps ``version``, and a
+# rebuild only swaps in its replay if the version is unchanged.
+#
+# Deleting an expense also sets ``last_deleted`` to its id in the same write,
+# so the ledger's change event tells every instance which expense went.
+LEDGER_COLLECTION = "group_balances"
+
+
+def _ledger():
+    return database.db[LEDGER_COLLECTION]
+
+
+def _merge(target: Dict[str, int], deltas: Dict[str, int], sign: int = 1):
+    for uid, delta in deltas.items():
+        target[uid] = target.get(uid, 0) + sign * delta
+
+
+async def _apply_deltas(
+    group_id: str, deltas: Dict[str, int], fields: Optional[dict] = None
+):
+    """Apply deltas of expenses that are already written, setting ``fields``
+    in exactly one of the writes."""
+    inc = {f"balances.{uid}": delta for uid, delta in deltas.items() if delta}
+    if not inc and not fields:
+        return
+    rebuilt = {"_id": group_id, "rebuilt": True}
+    update: dict = {"$inc": {**inc, "version": 1}}
+    if fields:
+        update["$set"] = fields
+    result = await _ledger().update_one(rebuilt, update)
+    if result.matched_count:
+        return
+
+    # Not rebuilt: reads replay history, which includes this expense. Bumping
+    # the version fails any rebuild that replayed before it was written; a
+    # ledger marked in between (from an empty history) takes the deltas.
+    bump: dict = {"$inc": {"version": 1}}
+    if fields:
+        bump["$set"] = fields
+    await _ledger().update_one({"_id": group_id}, bump, upsert=True)
+    if inc:
+        await _ledger().update_one(rebuilt, {"$inc": {**inc, "version": 1}})
+
+
+async def create_group_ledger(group_id: str):
+    """A new group has no history, so its ledger starts out rebuilt."""
+    await _ledger().insert_one(
+        {"_id": group_id, "balances": {}, "rebuilt": True, "version": 0}
+    )
+
+
+async def record_expense(expense: dict):
+    await _apply_deltas(str(expense["group_id"]), expense_deltas(expense))
+
+
+async def record_expenses(group_id: str, expenses: List[dict]):
+    """Apply many expenses of one group with a single $inc."""
+    deltas: Dict[str, int] = {}
+    for expense in expenses:
+        _merge(deltas, expense_deltas(expense))
+    await _apply_deltas(group_id, deltas)
+
+
+async def reverse_expense(expense: dict):
+    deltas: Dict[str, int] = {}
+    _merge(deltas, expense_deltas(expense), sign=-1)
+    await _apply_deltas(
+        str(expense["group_id"]), deltas, {"last_deleted": str(expense["_id"])}
+    )
+
+
+async def replace_expense(old_expense: dict, new_expense: dict):
+    """Apply the difference between two versions of the same expense."""
+    deltas: Dict[str, int] = {}
+    _merge(deltas, expense_deltas(old_expense), sign=-1)
+    _merge(deltas, expense_deltas(new_expense))
+    await _apply_deltas(str(new_expense["group_id"]), deltas)
+
+
+async def drop_group_ledger(group_id: str):
+    await _ledger().delete_one({"_id": group_id})
+
+
+async def get_group_net_balances(group_id: str) -> Dict[str, int]:
+    ledger = await _ledger().find_one({"_id": group_id})
+    if ledger is not None and ledger.get("rebuilt"):
+        return ledger.get("balances", {})
+
+    # Groups from before the ledger are replayed until `ledger rebuild` runs.
+    # Without any history nothing can be half-counted, so mark those now.
+    version = ledger.get("version") if ledger else None
+    balances, count = await _replay_group(group_id)
+    if not count:
+        await _swap_ledger(group_id, ledger is not None, version, balances)
+    return balances
+
+
+async def _replay_group(group_id: str) -> Tuple[Dict[str, int], int]:
+    cursor = database.db.expenses.find(
+        group_query(group_id),
+        # amount/split_details only matter for documents not yet migrated
+        {
+            "payer_id": 1,
+            "amount_minor": 1,
+            "split_minor": 1,
+            "amount": 1,
+            "split_details": 1,
+        },
+    )
+    balances: Dict[str, int] = {}
+    count = 0
+    async for expense in cursor:
+        _merge(balances, expense_deltas(expense))
+        count += 1
+    return balances, count
+
+
+async def _swap_ledger(
+    group_id: str, exists: bool, version: Optional[int], balances: Dict[str, int]
+) -> bool:
+    """Store a replay as the rebuilt ledger if nothing was written since
+    ``version`` was read. Returns whether it was stored."""
+    doc = {
+        "_id": group_id,
+        "balances": balances,
+        "rebuilt": True,
+        "version": (version or 0) + 1,
+    }
+    if not exists:
+        try:
+            await _ledger().insert_one(doc)
+            return True
+        except DuplicateKeyError:
+            return False
+    result = await _ledger().replace_one(
+        {
+            "_id": group_id,
+            # Ledgers written before versioning have no version field
+            "version": version if version is not None else {"$exists": False},
+        },
+        doc,
+    )
+    return bool(result.matched_count)
+
+
+async def rebuild_group_ledger(group_id: str) -> Dict[str, int]:
+    """Replay the group's history into its ledger.
+
+    Retried until no write lands between reading the version and the swap,
+    so concurrent $incs are never overwritten. A write whose expense the
+    replay already saw but whose $inc lands after the swap is still counted
+    twice, so run this (and ``ledger verify``) while writes are quiet.
+    """
+    while True:
+        current = await _ledger().find_one({"_id": group_id}, {"version": 1})
+        balances, _ = await _replay_group(group_id)
+        version = current.get("version") if current else None
+        if await _swap_ledger(group_id, current is not None, version, balances):
+            return balances
+
+
+async def verify_group_ledger(group_id: str) -> List[dict]:
+    """Compare the stored ledger with a full replay and list members that drifted."""
+    expected, _ = await _replay_group(group_id)
+    ledger = await _ledger().find_one({"_id": group_id}) or {}
+    stored = ledger.get("balances", {})
+
+    drift = []
+    for uid in sorted(set(expected) | set(stored)):
+        want = expected.get(uid, 0)
+        have = stored.get(uid, 0)
+        if want != have:
+            drift.append({"user_id": uid, "expected": want, "stored": have})
+    return drift
+
+
+async def _group_ids(group_id: Optional[str]) -> List[str]:
+    if group_id:
+        return [group_id]
+    cursor = database.db.groups.find({}, {"_id": 1})
+    return [str(g["_id"]) async for g in cursor]
+
+
+async def rebuild_all(group_id: Optional[str] = None) -> int:
+    group_ids = await _group_ids(group_id)
+    for gid in group_ids:
+        await rebuild_group_ledger(gid)
+    return len(group_ids)
+
+
+async def verify_all(group_id: Optional[str] = None) -> Dict[str, List[dict]]:
+    report = {}
+    for gid in await _group_ids(group_id):
+        drift = await verify_group_ledger(gid)
+        if drift:
+            report[gid] = drift
+    return report
@@ -0,0 +1,402 @@
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import database
+from money import expense_minor
+from etag import USER_VERSIONS_COLLECTION
+from services.expense_service import group_query, participant_query
+
+# One document per (user, calendar month): {user_id, month, paid, share, count},
+# paid and share in minor units
+ROLLUP_COLLECTION = "user_stats"
+ROLLUP_SORT = [("month", 1)]
+
+# The server-side aggregation behind rebuild and verify reads only migrated
+# fields (amount_minor, split_minor, participants), so both refuse to run until
+# `manage.py migrate money` (which also backfills participants) has run. Reads
+# for users not yet rebuilt replay expenses in Python and handle legacy ones.
+#
+# Deltas only apply to users whose rollups hold their whole history, marked
+# ``rollups_rebuilt`` on their user_versions document. Other users' stats are
+# aggregated from expenses on every read until `manage.py stats rebuild`
+# folds their history in. ``writes`` is bumped before a write decides, so a
+# read marking a user (only ever from an empty history) can tell it raced one.
+REBUILT_FIELD = "rollups_rebuilt"
+
+Key = Tuple[str, datetime]
+
+# The marker is never cleared, so users seen marked skip the lookup
+_rebuilt_users: Set[str] = set()
+
+
+def _rollups():
+    return database.db[ROLLUP_COLLECTION]
+
+
+def month_of(date: datetime) -> datetime:
+    return datetime(date.year, date.month, 1)
+
+
+def rollup_id(user_id: str, month: datetime) -> str:
+    return f"{user_id}:{month:%Y-%m}"
+
+
+def expense_rollup_deltas(expense: dict, sign: int = 1) -> Dict[Key, dict]:
+    """Per (user, month) increments one expense contributes to the rollups."""
+    month = month_of(expense.get("date") or datetime.utcnow())
+    payer = str(expense["payer_id"])
+    amount, splits = expense_minor(expense)
+
+    deltas = {}
+    for uid in {payer, *splits}:
+        deltas[(uid, month)] = {
+            "paid": sign * amount if uid == payer else 0,
+            "share": sign * splits.get(uid, 0),
+            "count": sign,
+        }
+    return deltas
+
+
+def _merge(target: Dict[Key, dict], deltas: Dict[Key, dict]):
+    for key, delta in deltas.items():
+        row = target.setdefault(key, {"paid": 0, "share": 0, "count": 0})
+        for field, value in delta.items():
+            row[field] += value
+
+
+def _versions():
+    return database.db[USER_VERSIONS_COLLECTION]
+
+
+async def _rebuilt(user_ids: Set[str]) -> Set[str]:
+    """Which of ``user_ids`` take deltas, for expenses already written."""
+    unknown = user_ids - _rebuilt_users
+    if unknown:
+        await _versions().bulk_write(
+            [
+                UpdateOne({"_id": uid}, {"$inc": {"writes": 1}}, upsert=True)
+                for uid in unknown
+            ],
+            ordered=False,
+        )
+        cursor = _versions().find(
+            {"_id": {"$in": list(unknown)}, REBUILT_FIELD: True}, {"_id": 1}
+        )
+        _rebuilt_users.update([doc["_id"] async for doc in cursor])
+    return user_ids & _rebuilt_users
+
+
+async def mark_new_user(user_id: str):
+    """A new user has no history, so their rollups start out rebuilt."""
+    await _versions().update_one(
+        {"_id": user_id}, {"$set": {REBUILT_FIELD: True}}, upsert=True
+    )
+    _rebuilt_users.add(user_id)
+
+
+async def _apply(deltas: Dict[Key, dict]):
+    rebuilt = await _rebuilt({uid for uid, _ in deltas})
+    ops = [
+        UpdateOne(
+            {"_id": rollup_id(uid, month)},
+            {
+                "$inc": delta,
+                "$setOnInsert": {"user_id": uid, "month": month},
+            },
+            upsert=True,
+        )
+        for (uid, month), delta in deltas.items()
+        if uid in rebuilt and any(delta.values())
+    ]
+    if ops:
+        await _rollups().bulk_write(ops, ordered=False)
+
+    # Even zero deltas (e.g. a description edit) change the recent-items feed
+    await bump_user_versions({uid for uid, _ in deltas})
+
+
+async def bump_user_versions(user_ids):
+    """Invalidate the stats ETag of every listed user."""
+    ops = [
+        UpdateOne({"_id": uid}, {"$inc": {"version": 1}}, upsert=True)
+        for uid in user_ids
+    ]
+    if ops:
+        await database.db[USER_VERSIONS_COLLECTION].bulk_write(ops, ordered=False)
+
+
+async def get_user_version(user_id: str) -> int:
+    doc = await database.db[USER_VERSIONS_COLLECTION].find_one({"_id": user_id})
+    return doc["version"] if doc else 0
+
+
+async def record_expense(expense: dict):
+    await _apply(expense_rollup_deltas(expense))
+
+
+async def record_expenses(expenses: List[dict]):
+    """Apply many expenses with a single bulk_write."""
+    deltas: Dict[Key, dict] = {}
+    for expense in expenses:
+        _merge(deltas, expense_rollup_deltas(expense))
+    await _apply(deltas)
+
+
+async def reverse_expense(expense: dict):
+    await _apply(expense_rollup_deltas(expense, sign=-1))
+
+
+async def replace_expense(old_expense: dict, new_expense: dict):
+    deltas: Dict[Key, dict] = {}
+    _merge(deltas, expense_rollup_deltas(old_expense, sign=-1))
+    _merge(deltas, expense_rollup_deltas(new_expense))
+    await _apply(deltas)
+
+
+async def reverse_group(group_id: str):
+    """Subtract every expense of a group, before the group's expenses are deleted."""
+    expected = await _aggregate(group_query(group_id))
+    deltas = {
+        key: {field: -value for field, value in row.items()}
+        for key, row in expected.items()
+    }
+    await _apply(deltas)
+
+
+async def get_user_rollups(user_id: str) -> List[dict]:
+    if user_id not in _rebuilt_users:
+        marker = await _versions().find_one({"_id": user_id})
+        if not (marker or {}).get(REBUILT_FIELD):
+            return await _unrebuilt_rollups(user_id, marker)
+        _rebuilt_users.add(user_id)
+
+    cursor = _rollups().find(scope(user_id)[1]).sort(ROLLUP_SORT)
+    return await cursor.to_list(length=None)
+
+
+def _history_query(user_id: str) -> dict:
+    """A user's expenses, including legacy ones without participants."""
+    return {
+        "$or": [
+            participant_query(user_id),
+            {
+                "participants": {"$exists": False},
+                "$or": [
+                    {"payer_id": user_id},
+                    {f"split_details.{user_id}": {"$exists": True}},
+                ],
+            },
+        ]
+    }
+
+
+async def _replay_user(user_id: str) -> Dict[Key, dict]:
+    """A user's rollups from their expenses, through expense_minor like the
+    write path, so unmigrated documents count the same as migrated ones."""
+    cursor = database.db.expenses.find(
+        _history_query(user_id),
+        {
+            "payer_id": 1,
+            "date": 1,
+            "amount_minor": 1,
+            "split_minor": 1,
+            "amount": 1,
+            "split_details": 1,
+        },
+    )
+    expected: Dict[Key, dict] = {}
+    async for expense in cursor:
+        deltas = expense_rollup_deltas(expense)
+        _merge(expected, {k: d for k, d in deltas.items() if k[0] == user_id})
+    return expected
+
+
+async def _unrebuilt_rollups(user_id: str, marker: Optional[dict]) -> List[dict]:
+    """Rollups replayed from the expenses of a user without stored ones."""
+    expected = await _replay_user(user_id)
+    if expected:
+        rows = [
+            {"user_id": uid, "month": month, **row}
+            for (uid, month), row in expected.items()
+        ]
+        return sorted(rows, key=lambda row: row["month"])
+
+    # Nothing to fold in, so store the (empty) rollups now unless a write
+    # started since the marker was read
+    if marker is None:
+        try:
+            await _versions().insert_one(
+                {"_id": user_id, "version": 0, "writes": 0, REBUILT_FIELD: True}
+            )
+        except DuplicateKeyError:
+            return []
+    else:
+        writes = marker.get("writes")
+        result = await _versions().update_one(
+            {
+                "_id": user_id,
+                "writes": writes if writes is not None else {"$exists": False},
+            },
+            {"$set": {REBUILT_FIELD: True}},
+        )
+        if not result.matched_count:
+            return []
+    _rebuilt_users.add(user_id)
+    return []
+
+
+def build_pipeline(match: dict, user_id: Optional[str] = None) -> list:
+    pipeline = [
+        {"$match": match},
+        {"$unwind": "$participants"},
+    ]
+    if user_id:
+        pipeline.append({"$match": {"participants": user_id}})
+    pipeline.append(
+        {
+            "$group": {
+                "_id": {
+                    "user_id": "$participants",
+                    "month": {"$dateTrunc": {"date": "$date", "unit": "month"}},
+                },
+                "paid": {
+                    "$sum": {
+                        "$cond": [
+                            {"$eq": ["$payer_id", "$participants"]},
+                            "$amount_minor",
+                            0,
+                        ]
+                    }
+                },
+                # split_minor is keyed by user id; pick this participant's value
+                "share": {
+                    "$sum": {
+                        "$reduce": {
+                            "input": {"$objectToArray": "$split_minor"},
+                            "initialValue": 0,
+                            "in": {
+                                "$cond": [
+                                    {"$eq": ["$$this.k", "$participants"]},
+                                    "$$this.v",
+                                    "$$value",
+                                ]
+                            },
+                        }
+                    }
+                },
+                "count": {"$sum": 1},
+            }
+        }
+    )
+    return pipeline
+
+
+async def _aggregate(match: dict, user_id: Optional[str] = None) -> Dict[Key, dict]:
+    """Recompute rollups from raw expenses on the server."""
+    pipeline = build_pipeline(match, user_id)
+    rows = await database.db.expenses.aggregate(pipeline).to_list(length=None)
+    return {
+        (row["_id"]["user_id"], row["_id"]["month"]): {
+            "paid": row["paid"],
+            "share": row["share"],
+            "count": row["count"],
+        }
+        for row in rows
+    }
+
+
+def scope(user_id: Optional[str]) -> Tuple[dict, dict]:
+    """(expense filter, rollup filter) for one user, or everyone."""
+    if user_id:
+        return participant_query(user_id), {"user_id": user_id}
+    return {}, {}
+
+
+async def _mark_rebuilt(user_id: Optional[str]):
+    if user_id:
+        user_ids = [user_id]
+    else:
+        cursor = database.db.users.find({}, {"_id": 1})
+        user_ids = [str(user["_id"]) async for user in cursor]
+    ops = [
+        UpdateOne({"_id": uid}, {"$set": {REBUILT_FIELD: True}}, upsert=True)
+        for uid in user_ids
+    ]
+    if ops:
+        await _versions().bulk_write(ops, ordered=False)
+    _rebuilt_users.update(user_ids)
+
+
+class MigrationPending(Exception):
+    """Expenses still lack the fields the rollup aggregation reads."""
+
+
+async def _require_migrated():
+    legacy = await database.db.expenses.count_documents(
+        {
+            "$or": [
+                {"amount_minor": {"$exists": False}},
+                {"participants": {"$exists": False}},
+            ]
+        },
+        limit=1,
+    )
+    if legacy:
+        raise MigrationPending(
+            "Some expenses are not migrated; run `manage.py migrate money` first"
+        )
+
+
+async def rebuild(user_id: Optional[str] = None) -> int:
+    """Recompute stored rollups from expenses and mark their users rebuilt.
+
+    Rows are replaced wholesale, so run this while expense writes are quiet.
+    Raises MigrationPending while legacy expenses remain.
+    """
+    await _require_migrated()
+    expense_match, rollup_match = scope(user_id)
+    expected = await _aggregate(expense_match, user_id)
+    await _rollups().delete_many(rollup_match)
+    if user_id:
+        await bump_user_versions([user_id])
+    else:
+        await database.db[USER_VERSIONS_COLLECTION].update_many(
+            {}, {"$inc": {"version": 1}}
+        )
+    if expected:
+        await _rollups().insert_many(
+            [
+                {"_id": rollup_id(uid, month), "user_id": uid, "month": month, **row}
+                for (uid, month), row in expected.items()
+            ]
+        )
+    await _mark_rebuilt(user_id)
+    return len(expected)
+
+
+async def verify(user_id: Optional[str] = None) -> List[dict]:
+    """Recompute rollups from raw expenses and list (user, month) rows that drifted."""
+    await _require_migrated()
+    expense_match, rollup_match = scope(user_id)
+    expected = await _aggregate(expense_match, user_id)
+    stored = {
+        (doc["user_id"], doc["month"]): doc
+        async for doc in _rollups().find(rollup_match)
+    }
+
+    empty = {"paid": 0, "share": 0, "count": 0}
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        want = expected.get(key, empty)
+        have = stored.get(key, empty)
+        if any(want[f] != have.get(f, 0) for f in empty):
+            drift.append(
+                {
+                    "user_id": key[0],
+                    "month": f"{key[1]:%Y-%m}",
+                    "expected": {f: want[f] for f in empty},
+                    "stored": {f: have.get(f, 0) for f in empty},
+                }
+            )
+    return drift
@@ -0,0 +1,98 @@
+"""Expense search for ``GET /api/expenses/search``.
+
+Searches every group the caller belongs to. ``q`` matches descriptions through
+the ``description_text`` index (whole words, stemmed); the other filters narrow
+by category, tags, payer, amount and date. Results come newest first and are
+keyset-paginated like group listing. Facet counts are computed only on the
+first page, in one aggregation run alongside the results query.
+"""
+
+from typing import List, Optional
+from datetime import datetime
+import asyncio
+import database
+from money import to_minor
+from pagination import keyset_after
+from services.expense_service import NEWEST_FIRST
+
+FACET_LIMIT = 20
+
+
+def build_query(
+    group_ids: List[str],
+    q: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    tags: Optional[List[str]] = None,
+    payer_id: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> dict:
+    query: dict = {"group_id": {"$in": group_ids}}
+    if q:
+        query["$text"] = {"$search": q}
+    if categories:
+        query["category"] = {"$in": categories}
+    if tags:
+        query["tags"] = {"$all": tags}
+    if payer_id:
+        query["payer_id"] = payer_id
+    if min_amount is not None or max_amount is not None:
+        query["amount_minor"] = {}
+        if min_amount is not None:
+            query["amount_minor"]["$gte"] = to_minor(min_amount)
+        if max_amount is not None:
+            query["amount_minor"]["$lte"] = to_minor(max_amount)
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lt"] = end
+    return query
+
+
+def _count_by(field: str) -> list:
+    return [
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": FACET_LIMIT},
+    ]
+
+
+async def facet_counts(query: dict) -> dict:
+    """Top categories, tags and payers among all matches, with counts."""
+    pipeline = [
+        # A $text match is only allowed as the first stage
+        {"$match": query},
+        {"$project": {"category": 1, "tags": 1, "payer_id": 1}},
+        {
+            "$facet": {
+                "total": [{"$count": "count"}],
+                "categories": _count_by("category"),
+                "tags": [{"$unwind": "$tags"}] + _count_by("tags"),
+                "payers": _count_by("payer_id"),
+            }
+        },
+    ]
+    facets = (await database.db.expenses.aggregate(pipeline).to_list(1))[0]
+    return {
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        **{
+            name: [{"value": b["_id"], "count": b["count"]} for b in facets[name]]
+            for name in ("categories", "tags", "payers")
+        },
+    }
+
+
+async def search(
+    query: dict, limit: int, position: Optional[tuple] = None, facets: bool = True
+):
+    """(one page of matches plus one to detect more, facets or None)."""
+    page_query = {**query, **keyset_after(*position)} if position else query
+    # Newest first; _id breaks ties between expenses sharing a date
+    cursor = database.db.expenses.find(page_query).sort(NEWEST_FIRST).limit(limit + 1)
+    if not facets or position:
+        return await cursor.to_list(length=limit + 1), None
+    return await asyncio.gather(cursor.to_list(length=limit + 1), facet_counts(query))
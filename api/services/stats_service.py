@@ -0,0 +1,72 @@
+from typing import List
+from datetime import datetime
+import database
+from money import expense_to_api, to_major
+from services import rollup_service
+from services.expense_service import participant_query
+
+RECENT_LIMIT = 5
+RECENT_SORT = [("date", -1)]
+
+
+def month_starts(months: int, today: datetime) -> List[datetime]:
+    """First instant of each of the last ``months`` calendar months, oldest first."""
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(months):
+        starts.append(datetime(year, month, 1))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return starts[::-1]
+
+
+def month_label(start: datetime, months: int) -> str:
+    # Within a year "%b" is unique; longer windows need the year to disambiguate
+    return start.strftime("%b") if months <= 12 else start.strftime("%b %Y")
+
+
+async def recent_expenses(user_id: str) -> List[dict]:
+    # participants_date index serves both the match and the sort
+    cursor = (
+        database.db.expenses.find(participant_query(user_id))
+        .sort(RECENT_SORT)
+        .limit(RECENT_LIMIT)
+    )
+    recent = []
+    async for e in cursor:
+        e["id"] = str(e.pop("_id"))
+        e = expense_to_api(e)
+        e["my_share"] = e["split_details"].get(user_id, 0.0)
+        recent.append(e)
+    return recent
+
+
+async def compute_user_stats(user_id: str, months: int = 6) -> dict:
+    """Dashboard stats from the per-month rollups: O(months of history) reads."""
+    rollups = await rollup_service.get_user_rollups(user_id)
+
+    total_paid = sum(r["paid"] for r in rollups)
+    total_share = sum(r["share"] for r in rollups)
+    expense_count = sum(r["count"] for r in rollups)
+
+    by_month = {r["month"]: r["share"] for r in rollups}
+    starts = month_starts(months, datetime.utcnow())
+    chart_data = [
+        {
+            "name": month_label(start, months),
+            "month": start.strftime("%Y-%m"),
+            "amount": to_major(by_month.get(start, 0)),
+        }
+        for start in starts
+    ]
+
+    return {
+        # Keeping naming consistent with frontend (My Cost)
+        "total_spent": to_major(total_share),
+        "total_paid": to_major(total_paid),
+        "net_balance": to_major(total_paid - total_share),
+        "recent_expenses": await recent_expenses(user_id),
+        "expense_count": expense_count,
+        "monthly_activity": chart_data,
+    }
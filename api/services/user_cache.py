@@ -0,0 +1,89 @@
+"""Cache of authenticated users, so get_current_user can skip the users lookup.
+
+Entries are keyed by user id and must be invalidated explicitly whenever the
+user document changes (see users.update_user / users.disable_user).
+"""
+
+from typing import Optional, Protocol
+from collections import OrderedDict
+import os
+import time
+from models import UserInDB
+
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
+
+class CacheBackend(Protocol):
+    """Storage for cached users. Implement this to share the cache across
+    workers (e.g. Redis); the in-process LRU is used otherwise."""
+
+    def get(self, key: str) -> Optional[UserInDB]: ...
+
+    def set(self, key: str, value: UserInDB, ttl: float) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def __len__(self) -> int: ...
+
+
+class LocalTTLCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[UserInDB]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: UserInDB, ttl: float) -> None:
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UserCache:
+    def __init__(self, backend: CacheBackend, ttl: float = USER_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[UserInDB]:
+        user = self.backend.get(user_id)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def set(self, user: UserInDB) -> None:
+        if self.ttl > 0 and user.id:
+            self.backend.set(user.id, user, self.ttl)
+
+    def invalidate(self, user_id: str) -> None:
+        self.backend.delete(user_id)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
+
+
+user_cache = UserCache(LocalTTLCache())
+
+
+def set_backend(backend: CacheBackend) -> None:
+    user_cache.backend = backend
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable
+from bson import ObjectId
+from bson.errors import InvalidId
+import database
+from models import UserSummary
+
+SUMMARY_PROJECTION = {"name": 1, "email": 1, "avatar": 1}
+
+
+def to_summary(user: dict) -> UserSummary:
+    return UserSummary(
+        id=str(user["_id"]),
+        name=user["name"],
+        email=user["email"],
+        avatar=user.get("avatar"),
+    )
+
+
+async def resolve_users(user_ids: Iterable[str]) -> Dict[str, UserSummary]:
+    """Fetch every requested user in a single $in query, keyed by id string.
+
+    Unknown or malformed ids are simply missing from the result.
+    """
+    object_ids = []
+    for uid in set(user_ids):
+        try:
+            object_ids.append(ObjectId(uid))
+        except (InvalidId, TypeError):
+            continue
+
+    if not object_ids:
+        return {}
+
+    cursor = database.db.users.find({"_id": {"$in": object_ids}}, SUMMARY_PROJECTION)
+    return {str(user["_id"]): to_summary(user) async for user in cursor}
+
+
+async def resolve_names(
+    user_ids: Iterable[str], default: str = "Unknown"
+) -> Dict[str, str]:
+    wanted = set(user_ids)
+    users = await resolve_users(wanted)
+    return {uid: users[uid].name if uid in users else default for uid in wanted}
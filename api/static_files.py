@@ -0,0 +1,290 @@
+"""Serving the built frontend (``client/dist``) and user uploads.
+
+The dist tree is listed once, on the first request for it, into a manifest of
+stat results, ETags and precompressed siblings, so serving a file needs no
+syscalls before the file is opened. Vite's content-hashed files are sent as
+``immutable``; ``index.html`` and the other unhashed files revalidate with
+their ETag. ``manage.py static compress`` writes the ``.br``/``.gz`` siblings
+that are sent to clients accepting them.
+
+Uploads change at runtime, so each request stats its one file. Their names
+never get reused for other content (content hashes, or uuids before those),
+so they are immutable too.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from pathlib import Path
+import gzip
+import mimetypes
+import os
+import re
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+from etag import not_modified
+
+try:
+    import brotli
+except ImportError:  # gzip siblings only
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Preferred first when the client accepts several
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+COMPRESSIBLE = {
+    ".html",
+    ".js",
+    ".mjs",
+    ".css",
+    ".svg",
+    ".json",
+    ".webmanifest",
+    ".txt",
+}
+# Smaller files don't gain enough to be worth a second lookup
+MIN_COMPRESS_BYTES = 1024
+
+# Vite names bundled files <name>-<8 char hash>.<ext>; the PWA plugin's
+# workbox runtime follows the same scheme
+HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.[a-z0-9]+$")
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("image/webp", ".webp")
+
+
+class StaticFile(NamedTuple):
+    path: Path
+    stat: os.stat_result
+    etag: str
+    media_type: str
+    # content-coding -> (path, stat) of the precompressed sibling
+    encoded: Dict[str, Tuple[Path, os.stat_result]]
+
+
+def _etag(stat: os.stat_result, coding: str = "") -> str:
+    suffix = f"-{coding}" if coding else ""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"'
+
+
+def _media_type(path: Path) -> str:
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+def _static_file(path: Path, stat: os.stat_result, encoded=None) -> StaticFile:
+    return StaticFile(path, stat, _etag(stat), _media_type(path), encoded or {})
+
+
+def is_immutable(relative: str) -> bool:
+    return relative.startswith("assets/") or bool(HASHED_NAME.search(relative))
+
+
+class DistManifest:
+    def __init__(self, root: Path):
+        self.root = root
+        self._files: Optional[Dict[str, StaticFile]] = None
+
+    def build(self) -> Dict[str, StaticFile]:
+        found: Dict[str, Tuple[Path, os.stat_result]] = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = Path(directory) / name
+                relative = path.relative_to(self.root).as_posix()
+                found[relative] = (path, path.stat())
+
+        files = {}
+        for relative, (path, stat) in found.items():
+            if any(
+                relative.endswith(ext) and relative[: -len(ext)] in found
+                for _, ext in ENCODINGS
+            ):
+                continue
+            encoded = {
+                coding: found[relative + ext]
+                for coding, ext in ENCODINGS
+                if relative + ext in found
+            }
+            files[relative] = _static_file(path, stat, encoded)
+        return files
+
+    def get(self, relative: str) -> Optional[StaticFile]:
+        if self._files is None:
+            self._files = self.build()
+        return self._files.get(relative)
+
+    def __len__(self) -> int:
+        return len(self._files) if self._files is not None else 0
+
+
+def _accepted_codings(request: Request) -> List[str]:
+    accepted = []
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if re.fullmatch(r"q=0(\.0*)?", params.replace(" ", "").lower()):
+            continue
+        accepted.append(coding.strip().lower())
+    return accepted
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """A single ``bytes=`` range as inclusive (start, end); None if unsatisfiable.
+
+    Multi-range requests get the first range only.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    first, _, last = spec.split(",")[0].strip().partition("-")
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _read_range(path: Path, start: int, length: int) -> bytes:
+    with path.open("rb") as handle:
+        handle.seek(start)
+        return handle.read(length)
+
+
+async def file_response(
+    request: Request, file: StaticFile, cache_control: str
+) -> Response:
+    headers = {"Cache-Control": cache_control}
+    if file.encoded:
+        headers["Vary"] = "Accept-Encoding"
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", file.etag) == file.etag:
+        size = file.stat.st_size
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{size}"},
+            )
+        start, end = byte_range
+        body = b""
+        if request.method != "HEAD":
+            body = await run_in_threadpool(
+                _read_range, file.path, start, end - start + 1
+            )
+        return Response(
+            body,
+            status_code=206,
+            media_type=file.media_type,
+            headers={
+                **headers,
+                "ETag": file.etag,
+                "Accept-Ranges": "bytes",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+            },
+        )
+
+    accepted = _accepted_codings(request)
+    for coding, _ in ENCODINGS:
+        if coding in file.encoded and coding in accepted:
+            path, stat = file.encoded[coding]
+            etag = _etag(file.stat, coding)
+            cached = not_modified(request, etag, cache_control)
+            if cached:
+                cached.headers.update(headers)
+                return cached
+            return FileResponse(
+                path,
+                stat_result=stat,
+                media_type=file.media_type,
+                headers={**headers, "ETag": etag, "Content-Encoding": coding},
+            )
+
+    cached = not_modified(request, file.etag, cache_control)
+    if cached:
+        cached.headers.update(headers)
+        return cached
+    return FileResponse(
+        file.path,
+        stat_result=file.stat,
+        media_type=file.media_type,
+        headers={**headers, "ETag": file.etag, "Accept-Ranges": "bytes"},
+    )
+
+
+async def serve_dist(request: Request, manifest: DistManifest, relative: str):
+    if relative == "api" or relative.startswith("api/"):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    file = manifest.get(relative)
+    if file is not None:
+        cache_control = IMMUTABLE if is_immutable(relative) else REVALIDATE
+        return await file_response(request, file, cache_control)
+
+    # A missing bundle must not be answered with HTML the browser would cache
+    if relative.startswith("assets/"):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    # Client-side routes all render the SPA shell
+    index = manifest.get("index.html")
+    if index is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return await file_response(request, index, REVALIDATE)
+
+
+def _stat_file(path: Path) -> Optional[os.stat_result]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat if path.is_file() else None
+
+
+async def serve_upload(request: Request, directory: Path, name: str):
+    if not name or name.startswith(".") or "/" in name or "\\" in name:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    path = directory / name
+    stat = await run_in_threadpool(_stat_file, path)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return await file_response(request, _static_file(path, stat), IMMUTABLE)
+
+
+def _compress_file(path: Path) -> List[Path]:
+    data = path.read_bytes()
+    written = []
+    outputs = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        outputs.insert(0, (".br", lambda raw: brotli.compress(raw, quality=11)))
+    for ext, compress in outputs:
+        packed = compress(data)
+        # Keep only siblings that actually save bytes
+        if len(packed) < len(data):
+            target = path.with_name(path.name + ext)
+            target.write_bytes(packed)
+            written.append(target)
+    return written
+
+
+def precompress(root: Path) -> List[Path]:
+    """Write .br (with the brotli package) and .gz siblings for text assets."""
+    written = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = Path(directory) / name
+            if path.suffix not in COMPRESSIBLE:
+                continue
+            if path.stat().st_size < MIN_COMPRESS_BYTES:
+                continue
+            written.extend(_compress_file(path))
+    return written
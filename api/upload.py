@@ -1,37 +1,84 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import shutil
+from typing import AsyncIterator
+from fastapi import APIRouter, HTTPException, Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
 import os
-import uuid
-from pathlib import Path
+from services import image_service
+from services.image_service import (
+    MAX_UPLOAD_BYTES,
+    UPLOAD_DIR,
+    UnsupportedImage,
+    UploadTooLarge,
+)
 
 router = APIRouter()
 
-UPLOAD_DIR = Path(__file__).resolve().parent / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Multipart framing around the file part
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+async def _capped_body(request: Request, limit: int) -> AsyncIterator[bytes]:
+    """The request body, failing as soon as more than ``limit`` bytes arrive.
+
+    Content-Length can't be relied on (chunked bodies have none), and a File()
+    parameter would spool the whole body before the handler ran.
+    """
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge()
+        yield chunk
+
+
+async def _read_upload(request: Request) -> UploadFile:
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected a multipart upload")
+
+    body = _capped_body(request, MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD)
+    parser = MultiPartParser(request.headers, body, max_files=1, max_fields=0)
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+    file = form.get("file")
+    if not isinstance(file, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail="No file in the upload")
+    return file
 
 
 @router.post("/")
-async def upload_file(file: UploadFile = File(...)):
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Only image files are allowed")
+async def upload_file(request: Request):
+    # Refuse oversized bodies up front when the client declares the length
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit():
+        if int(declared) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+            raise HTTPException(status_code=413, detail="Image is too large")
 
-    # Generate unique filename
-    file_ext = os.path.splitext(file.filename)[1]
-    filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOAD_DIR / filename
+    try:
+        file = await _read_upload(request)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Image is too large")
 
     try:
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to save file")
+        return await image_service.store_upload(file)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="Image is too large")
+    except UnsupportedImage:
+        raise HTTPException(
+            status_code=400, detail="Only PNG, JPEG, GIF and WebP images are allowed"
+        )
     finally:
-        file.file.close()
+        await file.close()
 
-    return {"url": f"/uploads/{filename}"}
 
+async def retain_image_file(file_url: str):
+    await image_service.retain(file_url)
 
-def delete_image_file(file_url: str):
+
+async def delete_image_file(file_url: str):
     if not file_url:
         return
 
@@ -39,6 +86,12 @@ def delete_image_file(file_url: str):
     if "/uploads/" not in file_url:
         return
 
+    # Content-addressed uploads may be shared, so only the last reference
+    # removes the file
+    if image_service.stored_name(file_url):
+        await image_service.release(file_url)
+        return
+
     try:
         # Extract filename from URL
         filename = file_url.split("/uploads/")[-1]
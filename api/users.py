@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 import models
 import database
 from auth import get_current_user
-from utils import get_password_hash
+from utils import get_password_hash_async
 from bson import ObjectId
-from upload import delete_image_file
+from pymongo import ReturnDocument
+from upload import delete_image_file, retain_image_file
+from services import rollup_service, stats_service
+from etag import CACHE_CONTROL, not_modified, set_etag, weak_etag
+from serialization import FAST_SERIALIZATION, fast_response
+from datetime import datetime
+from services.user_cache import user_cache
 
 router = APIRouter()
 
@@ -23,22 +29,36 @@ async def update_user(
 
     # Handle password update separately to hash it
     if "password" in update_data:
-        update_data["password_hash"] = get_password_hash(update_data["password"])
+        update_data["password_hash"] = await get_password_hash_async(
+            update_data["password"]
+        )
         del update_data["password"]
 
     if not update_data:
         return current_user
 
-    # Delete old avatar if it's being replaced
-    if "avatar" in update_data and update_data["avatar"] != current_user.avatar:
-        delete_image_file(current_user.avatar)
-
-    await database.db.users.update_one(
-        {"_id": ObjectId(current_user.id)}, {"$set": update_data}
+    # The pre-image tells us which avatar to clean up; the post-image is built
+    # locally from it
+    user = await database.db.users.find_one_and_update(
+        {"_id": ObjectId(current_user.id)},
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE,
     )
+    user_cache.invalidate(current_user.id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Only once the update is stored, so a failed one leaves the counts alone
+    if "avatar" in update_data and update_data["avatar"] != user.get("avatar"):
+        await retain_image_file(update_data["avatar"])
+        await delete_image_file(user.get("avatar"))
 
-    updated_user = await database.db.users.find_one({"_id": ObjectId(current_user.id)})
-    return models.UserInDB(**updated_user)
+    # Member details shown in group responses changed, so expire their ETags
+    if {"name", "email", "avatar"} & update_data.keys():
+        await database.db.groups.update_many(
+            {"members": current_user.id}, {"$inc": {"version": 1}}
+        )
+    return models.UserInDB(**{**user, **update_data})
 
 
 @router.post("/disable")
@@ -46,86 +66,28 @@ async def disable_user(current_user: models.UserInDB = Depends(get_current_user)
     await database.db.users.update_one(
         {"_id": ObjectId(current_user.id)}, {"$set": {"is_active": False}}
     )
+    user_cache.invalidate(current_user.id)
     return {"message": "User account disabled successfully"}
 
 
 @router.get("/stats")
-async def get_user_stats(current_user: models.UserInDB = Depends(get_current_user)):
-    # Match expenses where user is payer OR involved in split
-    pipeline = [
-        {
-            "$match": {
-                "$or": [
-                    {"payer_id": current_user.id},
-                    {f"split_details.{current_user.id}": {"$exists": True}},
-                ]
-            }
-        },
-        {"$sort": {"date": -1}},
-    ]
-
-    expenses_cursor = database.db.expenses.aggregate(pipeline)
-    expenses = await expenses_cursor.to_list(length=1000)
-
-    total_paid = 0.0
-    total_share = 0.0
-
-    processed_expenses = []
-
-    # Process expenses for validation and calculation
-    for e in expenses:
-        # Convert ObjectId to string
-        if "_id" in e:
-            e["id"] = str(e["_id"])
-            del e["_id"]
-
-        # Calculate stats
-        amount = e.get("amount", 0.0)
-        payer_id = e.get("payer_id")
-        split_details = e.get("split_details", {})
-
-        my_share = split_details.get(current_user.id, 0.0)
-
-        if payer_id == current_user.id:
-            total_paid += amount
-
-        total_share += my_share
-
-        # Add 'my_share' to expense object for frontend consistency if needed
-        e["my_share"] = my_share
-        processed_expenses.append(e)
-
-    net_balance = total_paid - total_share
-
-    # Monthly Activity (Last 6 months using my_share - Cost)
-    from datetime import datetime, timedelta
-
-    today = datetime.utcnow()
-    # Initialize last 6 months buckets
-    monthly_stats = {}
-    for i in range(5, -1, -1):
-        d = today - timedelta(days=i * 30)  # Approx month
-        month_label = d.strftime("%b")  # Jan, Feb
-        monthly_stats[month_label] = 0.0
-
-    # Aggregate
-    for e in processed_expenses:
-        if "date" in e and e["date"]:
-            dt = e["date"]
-            if (today - dt).days < 180:
-                month_label = dt.strftime("%b")
-                if month_label in monthly_stats:
-                    monthly_stats[month_label] += e["my_share"]
-
-    chart_data = [{"name": k, "amount": round(v, 2)} for k, v in monthly_stats.items()]
-
-    return {
-        "total_spent": round(
-            total_share, 2
-        ),  # Keeping naming consistent with frontend (My Cost)
-        "total_paid": round(total_paid, 2),
-        "net_balance": round(net_balance, 2),
-        "recent_expenses": processed_expenses[:5],
-        "expense_count": len(processed_expenses),
-        "monthly_activity": chart_data,
-    }
+async def get_user_stats(
+    request: Request,
+    response: Response,
+    months: int = Query(6, ge=1, le=24),
+    current_user: models.UserInDB = Depends(get_current_user),
+):
+    # The month buckets roll over with the calendar, so the month is in the tag
+    version = await rollup_service.get_user_version(current_user.id)
+    etag = weak_etag(
+        "stats", current_user.id, version, months, datetime.utcnow().strftime("%Y%m")
+    )
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    # Totals, calendar-month buckets and recent items are all computed in Mongo
+    stats = await stats_service.compute_user_stats(current_user.id, months)
+    if FAST_SERIALIZATION:
+        return fast_response(stats, {"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    set_etag(response, etag)
+    return stats
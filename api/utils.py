@@ -1,7 +1,10 @@
 import bcrypt
 from jose import jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+from errors import PasswordHasherBusy
 
 # SECURITY WARNING: Don't run with debug turned on in production!
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -12,6 +15,19 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# bcrypt cost factor for new hashes; stored hashes with another cost are
+# upgraded on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a small thread pool keeps the event loop free.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hashes allowed to wait for a worker before new requests are turned away.
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+
+_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+)
+_hash_in_flight = 0
+
 
 def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(
@@ -20,7 +36,38 @@ def verify_password(plain_password, hashed_password):
 
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    return bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    ).decode("utf-8")
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    # "$2b$12$<salt+hash>": the second field is the cost factor
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+async def _run_hasher(func, *args):
+    global _hash_in_flight
+    if _hash_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        raise PasswordHasherBusy()
+
+    _hash_in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_in_flight -= 1
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_hasher(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await _run_hasher(get_password_hash, password)
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -1,6 +1,9 @@
 import React from 'react';
 import { User } from 'lucide-react';
 
+// Content-addressed uploads have a small thumbnail next to the original
+const thumbnailUrl = (src) => src.replace(/(\/uploads\/[0-9a-f]{64})\.(png|jpg|gif|webp)$/, '$1.thumb.webp');
+
 const Avatar = ({ user, size = "w-8 h-8", fontSize = "text-xs" }) => {
     // Determines pixel size for strict inline styling based on Tailwind class
     const pxSize = size.includes("w-4") ? "16px" : "32px";
@@ -10,7 +13,8 @@ const Avatar = ({ user, size = "w-8 h-8", fontSize = "text-xs" }) => {
     if (user?.avatar) {
         return user.avatar.match(/^http|\/uploads/) ? 
           <img 
-              src={user.avatar} 
+              src={thumbnailUrl(user.avatar)} 
+              onError={(e) => { if (!e.currentTarget.dataset.original) { e.currentTarget.dataset.original = '1'; e.currentTarget.src = user.avatar; } }}
               alt={user.name} 
               className={`${size} rounded-full object-cover border border-[var(--border-color)] block`} 
               style={style} 
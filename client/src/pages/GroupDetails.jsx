@@ -27,7 +27,7 @@ function GroupDetails() {
       setGroup(groupRes.data);
 
       const expensesRes = await api.get(`/expenses/group/${id}`);
-      setExpenses(expensesRes.data.reverse()); // Show newest first
+      setExpenses(expensesRes.data); // Server returns newest first
 
       const balancesRes = await api.get(`/expenses/group/${id}/balances`);
       setBalances(balancesRes.data);